@@ -45,3 +45,20 @@ def compile_template(f,template_vals,cc_module=None,fsig="",_globals=None):
 	# print(exec_code)
 	exec(exec_code,_globals,l)
 	return l['out_func']
+
+
+def compile_variant(f, suffix, global_overrides={}, **options):
+	'''Recompiles the njit'ed function 'f' under the name f_name+"_"+suffix with its jit 
+		options updated by 'options' (e.g. parallel=True, cache=True). Any globals named in 
+		'global_overrides' are swapped out in the copy, which lets a variant call other 
+		variants. Since the copy has its own name it can be cached alongside the original.'''
+	py_func = f.py_func
+	name = f"{py_func.__name__}_{suffix}"
+	_globals = {**py_func.__globals__, **global_overrides}
+	new_py_func = FunctionType(py_func.__code__, _globals, name,
+						py_func.__defaults__, py_func.__closure__)
+	new_py_func.__qualname__ = name
+	new_py_func.__doc__ = py_func.__doc__
+	options = {**{k:v for k,v in f.targetoptions.items() if k != 'nopython'}, 
+				'locals' : f.locals, **options}
+	return njit(**options)(new_py_func)
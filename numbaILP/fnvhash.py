@@ -6,6 +6,7 @@ from numba.typed import List, Dict
 from numba.core.types import ListType, DictType, unicode_type, NamedTuple
 from numba.experimental import jitclass
 from collections import namedtuple
+from numbaILP.structref import define_structref
 import numpy as np
 
 FNV_32_PRIME = 0x01000193
@@ -58,6 +59,252 @@ bytarr_type = u1[::1]
 # lst_bytarr_type = ListType(bytarr_type)
 
 
+###### 64-bit Word Hashing ######
+
+# As numpy scalars so that numba keeps the arithmetic in uint64 
+FNV1A_64_INIT = np.uint64(FNV1_64A_INIT)
+FNV1A_64_PRIME = np.uint64(FNV_64_PRIME)
+
+@njit(nogil=True,fastmath=True,cache=True,inline='always')
+def fnv1a_64_update(hval, word):
+    """
+    Folds one uint32 word into the 64 bit FNV-1a hash value hval.
+    """
+    return (hval ^ u8(word)) * FNV1A_64_PRIME
+
+@njit(nogil=True,fastmath=True,cache=True)
+def fnv1a_64_words(data):
+    """
+    Returns the 64 bit FNV-1a hash value of a uint32 array, taken one word at a time 
+    instead of one byte at a time. Can also be built incrementally with fnv1a_64_update
+    starting from FNV1A_64_INIT.
+    """
+    hval = FNV1A_64_INIT
+    for i in range(len(data)):
+        hval = fnv1a_64_update(hval, data[i])
+    return hval
+
+FMIX_64_C1 = np.uint64(0xff51afd7ed558ccd)
+FMIX_64_C2 = np.uint64(0xc4ceb9fe1a85ec53)
+
+@njit(nogil=True,fastmath=True,cache=True,inline='always')
+def fmix64(hval):
+    """
+    The 64 bit finalizer of MurmurHash3. The low bits of an FNV hash value taken a word 
+    at a time only depend on the low bits of each word, so it is mixed before masking.
+    """
+    hval ^= hval >> u8(33)
+    hval *= FMIX_64_C1
+    hval ^= hval >> u8(33)
+    hval *= FMIX_64_C2
+    hval ^= hval >> u8(33)
+    return hval
+
+
+###### Sample Set Fingerprints ######
+
+# A set of uint32 sample indicies is identified by a 128-bit fingerprint: the sums (mod 2^64) 
+#  of two independent 64-bit pseudo-random keys of each sample. Since it is a sum it doesn't 
+#  depend on the order of the samples, and it can be built up one sample at a time.
+SPLITMIX_GAMMA = np.uint64(0x9e3779b97f4a7c15)
+SPLITMIX_C1 = np.uint64(0xbf58476d1ce4e5b9)
+SPLITMIX_C2 = np.uint64(0x94d049bb133111eb)
+FINGERPRINT_SEED = np.uint64(0x2545f4914f6cdd1d)
+
+@njit(nogil=True,fastmath=True,cache=True,inline='always')
+def splitmix64(x):
+    """
+    The output function of SplitMix64, a bijection on uint64 with good avalanche.
+    """
+    z = x + SPLITMIX_GAMMA
+    z = (z ^ (z >> u8(30))) * SPLITMIX_C1
+    z = (z ^ (z >> u8(27))) * SPLITMIX_C2
+    return z ^ (z >> u8(31))
+
+@njit(nogil=True,fastmath=True,cache=True,inline='always')
+def sample_keys(i):
+    """
+    Returns the two 64 bit keys of sample i that are summed into a fingerprint.
+    """
+    x = u8(i)
+    return splitmix64(x), splitmix64(x ^ FINGERPRINT_SEED)
+
+@njit(nogil=True,fastmath=True,cache=True)
+def fingerprint(data):
+    """
+    Returns the 128 bit fingerprint of the set of samples in a uint32 array as (lo, hi).
+    """
+    lo, hi = u8(0), u8(0)
+    for i in range(len(data)):
+        k_lo, k_hi = sample_keys(data[i])
+        lo += k_lo
+        hi += k_hi
+    return lo, hi
+
+
+###### Fingerprint Keyed Dictionary ######
+
+# Maps 128-bit fingerprints to i4 values. Unlike an ArrayKeyedDict the keys themselves
+#  aren't stored, only their fingerprints, in a linearly probed table where an empty slot 
+#  has the value -1.
+fpd_fields = [
+    ('lo', u8[::1]),
+    ('hi', u8[::1]),
+    ('values', i4[::1]),
+    ('size', i8),
+]
+
+FingerprintDict, FingerprintDictType = define_structref("FingerprintDict", fpd_fields)
+
+@njit(nogil=True,cache=True)
+def new_fpd(capacity=16):
+    '''Makes an empty FingerprintDict. 'capacity' must be a power of 2.'''
+    return FingerprintDict(np.zeros((capacity,),dtype=np.uint64),
+        np.zeros((capacity,),dtype=np.uint64),
+        np.full((capacity,),-1,dtype=np.int32), 0)
+
+@njit(nogil=True,fastmath=True,cache=True)
+def _fpd_find(fpd, lo, hi):
+    '''Returns the slot of the fingerprint (lo, hi) in fpd, or the empty slot it would be
+        inserted into'''
+    mask = len(fpd.values)-1
+    # The fingerprint is already well mixed so its low bits are used directly
+    s = i8(lo & u8(mask))
+    while(fpd.values[s] != -1):
+        if(fpd.lo[s] == lo and fpd.hi[s] == hi): return s
+        s = (s+1) & mask
+    return s
+
+@njit(nogil=True,fastmath=True,cache=True)
+def _fpd_grow(fpd):
+    '''Doubles the number of slots in fpd and reinserts its fingerprints'''
+    old_lo, old_hi, old_values = fpd.lo, fpd.hi, fpd.values
+    capacity = 2*len(old_values)
+    fpd.lo = np.zeros((capacity,),dtype=np.uint64)
+    fpd.hi = np.zeros((capacity,),dtype=np.uint64)
+    fpd.values = np.full((capacity,),-1,dtype=np.int32)
+    for t in range(len(old_values)):
+        if(old_values[t] == -1): continue
+        s = _fpd_find(fpd, old_lo[t], old_hi[t])
+        fpd.lo[s], fpd.hi[s], fpd.values[s] = old_lo[t], old_hi[t], old_values[t]
+
+@njit(nogil=True,fastmath=True,cache=True)
+def fpd_insert(fpd,lo,hi,item):
+    '''Inserts an i4 item into the dictionary keyed by the fingerprint (lo, hi) (if it 
+        isn't already in it)'''
+    # Keep the load factor at most 1/2
+    if(2*(fpd.size+1) > len(fpd.values)): _fpd_grow(fpd)
+    s = _fpd_find(fpd, lo, hi)
+    if(fpd.values[s] == -1):
+        fpd.lo[s], fpd.hi[s], fpd.values[s] = lo, hi, item
+        fpd.size += 1
+
+@njit(nogil=True,fastmath=True,cache=True)
+def fpd_get(fpd,lo,hi):
+    '''Gets the i4 value keyed by the fingerprint (lo, hi), or -1 if there isn't one'''
+    return fpd.values[_fpd_find(fpd, lo, hi)]
+
+@njit(nogil=True,fastmath=True,cache=True)
+def fpd_remove(fpd,lo,hi):
+    '''Removes the fingerprint (lo, hi) from the dictionary (if it is in it)'''
+    mask = len(fpd.values)-1
+    s = _fpd_find(fpd, lo, hi)
+    if(fpd.values[s] == -1): return
+    fpd.values[s] = -1
+    fpd.size -= 1
+
+    # Instead of leaving a tombstone, shift back any later entries in the same probe run
+    #  whose home slot isn't cyclically in (s, t] 
+    t = s
+    while(True):
+        t = (t+1) & mask
+        if(fpd.values[t] == -1): break
+        home = i8(fpd.lo[t] & u8(mask))
+        stays = (s < home <= t) if s < t else (home > s or home <= t)
+        if(not stays):
+            fpd.lo[s], fpd.hi[s], fpd.values[s] = fpd.lo[t], fpd.hi[t], fpd.values[t]
+            fpd.values[t] = -1
+            s = t
+
+
+###### Open Addressing Array Keyed Dictionary ######
+
+# Maps uint32 arrays (i.e. the sample indicies of a node) to i4 values. The keys and values 
+#  are kept in insertion order and 'slots' is a linearly probed table of indicies into them
+#  (-1 if empty), with the hash of each slot's key kept alongside so that full keys are 
+#  only compared when their hashes match. 
+akd_fields = [
+    ('hashes', u8[::1]),
+    ('slots', i8[::1]),
+    ('keys', ListType(u4[::1])),
+    ('values', ListType(i4)),
+]
+
+ArrayKeyedDict, ArrayKeyedDictType = define_structref("ArrayKeyedDict", akd_fields)
+
+@njit(nogil=True,cache=True)
+def new_akd(capacity=16):
+    '''Makes an empty ArrayKeyedDict. 'capacity' must be a power of 2.'''
+    return ArrayKeyedDict(np.zeros((capacity,),dtype=np.uint64),
+        np.full((capacity,),-1,dtype=np.int64),
+        List.empty_list(u4[::1]), List.empty_list(i4))
+
+@njit(nogil=True,fastmath=True,cache=True)
+def _akd_find(akd, arr, h):
+    '''Returns the slot of 'arr' in akd, or the empty slot it would be inserted into'''
+    mask = len(akd.slots)-1
+    s = i8(fmix64(h) & u8(mask))
+    while(True):
+        k = akd.slots[s]
+        if(k == -1): return s
+        if(akd.hashes[s] == h):
+            key = akd.keys[k]
+            if(len(key) == len(arr) and (key == arr).all()):
+                return s
+        s = (s+1) & mask
+
+@njit(nogil=True,fastmath=True,cache=True)
+def _akd_grow(akd):
+    '''Doubles the number of slots in akd and reinserts its keys'''
+    old_hashes, old_slots = akd.hashes, akd.slots
+    capacity = 2*len(old_slots)
+    mask = capacity-1
+    akd.hashes = np.zeros((capacity,),dtype=np.uint64)
+    akd.slots = np.full((capacity,),-1,dtype=np.int64)
+    for t in range(len(old_slots)):
+        if(old_slots[t] == -1): continue
+        h = old_hashes[t]
+        # Every key is unique so only an empty slot needs to be found 
+        s = i8(fmix64(h) & u8(mask))
+        while(akd.slots[s] != -1):
+            s = (s+1) & mask
+        akd.hashes[s] = h
+        akd.slots[s] = old_slots[t]
+
+@njit(nogil=True,fastmath=True,cache=True)
+def akd_insert(akd,arr,item,h=None):
+    '''Inserts an i4 item into the dictionary keyed by a uint32 array 'arr' (if it isn't 
+        already in it). 'h' is the fnv1a_64_words hash of arr if it is already known.'''
+    if(h is None): h = fnv1a_64_words(arr)
+    # Keep the load factor at most 1/2
+    if(2*(len(akd.keys)+1) > len(akd.slots)): _akd_grow(akd)
+    s = _akd_find(akd, arr, h)
+    if(akd.slots[s] == -1):
+        akd.hashes[s] = h
+        akd.slots[s] = len(akd.keys)
+        akd.keys.append(arr)
+        akd.values.append(i4(item))
+
+@njit(nogil=True,fastmath=True,cache=True)
+def akd_get(akd,arr,h=None):
+    '''Gets the i4 value keyed by a uint32 array 'arr', or -1 if there isn't one.
+        'h' is the fnv1a_64_words hash of arr if it is already known.'''
+    if(h is None): h = fnv1a_64_words(arr)
+    k = akd.slots[_akd_find(akd, arr, h)]
+    if(k == -1): return i4(-1)
+    return akd.values[k]
+
+
 def AKD(typ,ret_be=False):
     # lst_custom_type = ListType(typ)
 
@@ -259,6 +506,73 @@ class TestAKD(unittest.TestCase):
         self.assertFalse(akd_includes(akd,c,0))
         self.assertEqual(akd_get(akd,c,0),None)
 
+    def test_open_addressing(self):
+        @njit
+        def insert_get(arrs, h=None):
+            akd = new_akd(4)
+            for i in range(len(arrs)): akd_insert(akd,arrs[i],i,h)
+            # Inserting an existing key keeps the old value
+            for i in range(len(arrs)): akd_insert(akd,arrs[i].copy(),-2,h)
+            out = np.empty(len(arrs),dtype=np.int32)
+            for i in range(len(arrs)): out[i] = akd_get(akd,arrs[i],h)
+            return out, akd_get(akd,np.array([9,9,9],np.uint32),h)
+
+        arrs = List([np.array([1,2,3],np.uint32), np.array([1,2],np.uint32),
+                     np.array([3,2,1],np.uint32), np.array([1,2,3],np.uint32)]+
+                    [np.arange(i,dtype=np.uint32) for i in range(20)])
+        expected = [0,1,2,0]+list(range(4,24))
+        # With the real hashes and with every key colliding
+        for h in [None, np.uint64(0)]:
+            out, missing = insert_get(arrs, h)
+            self.assertEqual(list(out), expected)
+            self.assertEqual(missing, -1)
+
+        # The hash can be built up incrementally
+        @njit
+        def incremental_hash(a):
+            hval = FNV1A_64_INIT
+            for x in a: hval = fnv1a_64_update(hval, x)
+            return hval
+        a = np.array([5,1,8],np.uint32)
+        self.assertEqual(incremental_hash(a), fnv1a_64_words(a))
+
+    def test_fingerprints(self):
+        @njit
+        def insert_get(arrs):
+            fpd = new_fpd(4)
+            for i in range(len(arrs)):
+                lo, hi = fingerprint(arrs[i])
+                fpd_insert(fpd,lo,hi,i)
+            out = np.empty(len(arrs),dtype=np.int32)
+            for i in range(len(arrs)):
+                lo, hi = fingerprint(arrs[i])
+                out[i] = fpd_get(fpd,lo,hi)
+            lo, hi = fingerprint(np.array([9,9,9],np.uint32))
+            return out, fpd_get(fpd,lo,hi)
+
+        # Fingerprints don't depend on the order of the samples
+        arrs = List([np.array([1,2,3],np.uint32), np.array([1,2],np.uint32),
+                     np.array([3,2,1],np.uint32), np.array([4],np.uint32)]+
+                    [np.arange(i,dtype=np.uint32) for i in range(20)])
+        out, missing = insert_get(arrs)
+        self.assertEqual(list(out), [0,1,0,3]+list(range(4,24)))
+        self.assertEqual(missing, -1)
+
+    def test_fingerprint_remove(self):
+        @njit
+        def insert_remove(n):
+            # Every fingerprint lands in the same home slot so they form one probe run
+            fpd = new_fpd(64)
+            for i in range(n): fpd_insert(fpd,u8(i << 8),u8(i),i)
+            for i in range(0,n,2): fpd_remove(fpd,u8(i << 8),u8(i))
+            out = np.empty(n,dtype=np.int32)
+            for i in range(n): out[i] = fpd_get(fpd,u8(i << 8),u8(i))
+            return out, fpd.size
+
+        out, size = insert_remove(20)
+        self.assertEqual(list(out), [-1 if i % 2 == 0 else i for i in range(20)])
+        self.assertEqual(size, 10)
+
         # BE_deffered = deferred_type()
 # @jitclass([('key', u4),
 #            ('value', u4),
@@ -14,13 +14,15 @@ import timeit
 from sklearn import tree as SKTree
 import os 
 from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 
 from numba import config, njit, threading_layer
 from numba.np.ufunc.parallel import _get_thread_id
 from sklearn.preprocessing import OneHotEncoder
-from numbaILP.fnvhash import hasharray#, AKD#, akd_insert,akd_get
+from numbaILP.fnvhash import new_akd, akd_insert, akd_get
+from numbaILP.compile_template import compile_variant
 
-config.THREADING_LAYER = 'thread_safe'
+config.THREADING_LAYER = 'threadsafe'
 print("n threads", config.NUMBA_NUM_THREADS)
 # os.environ['NUMBA_PARALLEL_DIAGNOSTICS'] = '1'
 
@@ -37,6 +39,9 @@ PRED_CHOICE_pure_majority = 2
 PRED_CHOICE_majority_general = 3
 PRED_CHOICE_pure_majority_general = 4
 
+PARALLEL_none = 0
+PARALLEL_features = 1
+
 N = 100
 def time_ms(f):
     f() #warm start
@@ -118,7 +123,7 @@ def expand_nominal_split_cache(st, n_vals,n_classes):
     shp = st.y_counts_per_v.shape
     y_counts_per_v[:shp[0],:shp[1]] = st.y_counts_per_v
     y_counts_per_v[:shp[0],shp[1]:] = 0
-    y_counts_per_v[:shp[0]] = 0
+    y_counts_per_v[shp[0]:] = 0
     st.y_counts_per_v = y_counts_per_v
     return st
 
@@ -194,8 +199,11 @@ splitter_context_fields = [
     #  kept contiguous in each node by swapping left and right indicies 
     #  then only 'start' and 'end' need to be passed instead of copying the indicies
     ('sample_inds', u4[::1]),
-    # ('start',i8),
-    # ('end', i8),
+    ('start',i8),
+    ('end', i8),
+
+    # The depth of the node, the root is at depth 0
+    ('depth', i8),
 
     
 
@@ -297,14 +305,15 @@ def DataStats_ctor(X, Y):
 
 
 @njit(cache=True)
-def SplitterContext_ctor(parent_ptr, node, sample_inds, y_counts, impurity):
+def SplitterContext_ctor(parent_ptr, node, sample_inds, start, end, y_counts, impurity, depth=0):
     st = new(SplitterContextType)
     # st.counts_cached = False
     st.parent_ptr = parent_ptr
     st.node = node
     st.sample_inds = sample_inds
-    # st.start = start
-    # st.end = end
+    st.start = start
+    st.end = end
+    st.depth = depth
     # st.n_samples = len(sample_inds)
     # st.n_samples = end-start
 
@@ -337,7 +346,7 @@ def SplitterContext_dtor(sc):
             _decref_pointer(ptr)
 
 @njit(cache=True,parallel=False)
-def update_nominal_impurities(data_stats, splitter_context):
+def update_nominal_impurities(data_stats, splitter_context, min_samples_leaf=1):
     #Make various variables local
     ds = data_stats
     sc = splitter_context
@@ -353,8 +362,11 @@ def update_nominal_impurities(data_stats, splitter_context):
     # feature_inds = sc.feature_inds
     # n_const_fts = sc.n_const_fts
     sample_inds = sc.sample_inds
-    n_samples = len(sc.sample_inds)
+    start, end = sc.start, sc.end
+    # Only the samples in [start,end) are added to the caches, which may already hold the 
+    #  counts of earlier samples (see ifit_tree), so take the total from y_counts
     y_counts = sc.y_counts
+    n_samples = np.int64(np.sum(y_counts))
     impurity = sc.impurity
     
 
@@ -403,10 +415,8 @@ def update_nominal_impurities(data_stats, splitter_context):
 
 
         #Update the feature counts for labels and values
-        # for k_i in range(start, end):
-        # print(Y,sample_inds)
-        for i in sample_inds:
-            # i = sample_inds[k_i]
+        for k_i in range(start, end):
+            i = sample_inds[k_i]
             y_i = Y[i]
             y_counts_per_v[X[i,j],y_i] += 1
             v_counts[X[i,j]] += 1
@@ -427,6 +437,8 @@ def update_nominal_impurities(data_stats, splitter_context):
 
                 counts_l = y_counts-counts_r
                 total_l = n_samples-total_r
+                if(min_samples_leaf > 1 and 
+                   (total_l < min_samples_leaf or total_r < min_samples_leaf)): continue
 
                 imp_l = gini(total_l, counts_l)
                 imp_r = gini(total_r, counts_r)
@@ -460,12 +472,12 @@ def build_root(X_nom,x_cont,Y):
     impurity = gini(len(Y),ds.y_counts)
     
 
-    node_dict = Dict.empty(u4,BE_List)
+    node_dict = new_akd()
     nodes = List.empty_list(TN)
     node = TreeNode_ctor(TTYPE_NODE,i4(0),ds.y_counts)
     nodes.append(node)
 
-    c = SplitterContext_ctor(0, node, sample_inds , ds.y_counts, impurity)
+    c = SplitterContext_ctor(0, node, sample_inds, 0, len(Y), ds.y_counts, impurity)
     context_stack = List.empty_list(SplitterContextType)
     context_stack.append(c)
 
@@ -479,57 +491,25 @@ def choose_next_splits():
     pass
 
 
-###### Array Keyed Dictionaries ######
-
-BE = Tuple([u1[::1],i4])
-BE_List = ListType(BE)
-
-@njit(nogil=True,fastmath=True)
-def akd_insert(akd,_arr,item,h=None):
-    '''Inserts an i4 item into the dictionary keyed by an array _arr'''
-    arr = _arr.view(np.uint8)
-    if(h is None): h = hasharray(arr)
-    elems = akd.get(h,List.empty_list(BE))
-    is_in = False
-    for elem in elems:
-        if(len(elem[0]) == len(arr) and
-            (elem[0] == arr).all()): 
-            is_in = True
-            break
-    if(not is_in):
-        elems.append((arr,item))
-        akd[h] = elems
-
-@njit(nogil=True,fastmath=True)
-def akd_get(akd,_arr,h=None):
-    '''Gets an i4 from a dictionary keyed by an array _arr'''
-    arr = _arr.view(np.uint8)
-    if(h is None): h = hasharray(arr) 
-    if(h in akd):
-        for elem in akd[h]:
-            if(len(elem[0]) == len(arr) and
-                (elem[0] == arr).all()): 
-                return elem[1]
-    return -1
-
-
 TTYPE_NODE = u1(1)
 TTYPE_LEAF = u1(2)
 
 @njit(cache=True)
-def new_node(locs, c_ptr, sample_inds,y_counts,impurity):
-    node_dict, nodes, context_stack, cache_nodes = locs
+def new_node(locs, c_ptr, sample_inds, start, end, y_counts,impurity,depth):
+    node_dict, nodes, context_stack, cache_nodes, max_depth, min_split = locs
         # node_dict,nodes,new_contexts,cache_nodes = locs
         # NODE, LEAF = i4(1), i4(2) #np.array(1,dtype=np.int32).item(), np.array(2,dtype=np.int32).item()
     node_id = i4(-1)
-    if (cache_nodes): node_id= akd_get(node_dict,sample_inds)
+    if (cache_nodes): node_id= akd_get(node_dict,sample_inds[start:end])
     if(node_id == -1):
         node_id = i4(len(nodes))
-        if(cache_nodes): akd_insert(node_dict,sample_inds,node_id)
-        if(impurity > 0.0):
+        # sample_inds is partitioned in place further down so the key must be a copy
+        if(cache_nodes): akd_insert(node_dict,sample_inds[start:end].copy(),node_id)
+        # Nodes that the stopping rules would never split become leaves without a context
+        if(impurity > 0.0 and (max_depth == 0 or depth < max_depth) and end-start >= min_split):
             node = TreeNode_ctor(TTYPE_NODE,node_id,y_counts)
             nodes.append(node)
-            new_c = SplitterContext_ctor(c_ptr, node, sample_inds, y_counts, impurity)
+            new_c = SplitterContext_ctor(c_ptr, node, sample_inds, start, end, y_counts, impurity, depth)
             context_stack.append(new_c)
             # new_contexts.append(SplitContext(new_inds,
             #     impurity,countsPS[split,ind], node))
@@ -540,6 +520,26 @@ def new_node(locs, c_ptr, sample_inds,y_counts,impurity):
 
 Tree, TreeType = define_structref("Tree",[("nodes",ListType(TN)),('u_ys', i4[::1])])
 
+# A flat array backed copy of a fitted Tree used for prediction. The splits of node i 
+#  are split_starts[i]:split_starts[i+1] of the per-split arrays, and leaf_value holds 
+#  the index of the majority class of each leaf (-1 for non-leaves).
+frozen_tree_fields = [
+    ('ttype', u1[::1]),
+    ('op', u1[::1]),
+    ('split_starts', i4[::1]),
+    ('is_continous', u1[::1]),
+    ('feature', i4[::1]),
+    ('val', i4[::1]),
+    ('left', i4[::1]),
+    ('right', i4[::1]),
+    ('leaf_value', i4[::1]),
+    ('counts', u4[:,::1]),
+    ('u_ys', i4[::1])
+]
+FrozenTree, FrozenTreeType = define_structref("FrozenTree", frozen_tree_fields)
+
+u4_arr = u4[::1]
+
 @njit(cache=True)
 def extract_nominal_split_info(data_stats, c, split):
     bst_imps = c.impurities[split]
@@ -554,22 +554,22 @@ def extract_nominal_split_info(data_stats, c, split):
     # print("P")
     # print(c.y_counts,y_counts_l, y_counts_r)
 
-    inds_l = np.empty(np.sum(y_counts_l), dtype=np.uint32)
+    # Stably partition the node's span of sample_inds in place, lefts first then rights.
+    #  Only the rights need to be set aside. 
+    sample_inds = c.sample_inds
     inds_r = np.empty(np.sum(y_counts_r), dtype=np.uint32)
-    p_l, p_r = 0, 0
-    for ind in c.sample_inds:
+    p_l, p_r = c.start, 0
+    for k in range(c.start, c.end):
+        ind = sample_inds[k]
         if (data_stats.X[ind, split]==splt_c.best_v):
             inds_r[p_r] = ind
             p_r += 1
         else:
-            inds_l[p_l] = ind
+            sample_inds[p_l] = ind
             p_l += 1
+    sample_inds[p_l:c.end] = inds_r[:p_r]
 
-    # print(inds_l, inds_r)
-    # print("P")
-    # print(inds_l, inds_r)
-
-    return inds_l, inds_r, y_counts_l, y_counts_r, imp_tot, imp_l, imp_r, best_v
+    return p_l, y_counts_l, y_counts_r, imp_tot, imp_l, imp_r, best_v
             
 
 
@@ -582,6 +582,8 @@ def fit_tree(X_nom, X_cont, Y, config,iterative=False):
     cache_nodes = False
     # print("Z")
     data_stats, context_stack, node_dict, nodes = build_root(X_nom, X_cont,Y)
+    # A node needs at least this many samples to be split 
+    min_split = max(config.min_samples_split, 2*config.min_samples_leaf)
     
     # print("A")
     
@@ -589,13 +591,18 @@ def fit_tree(X_nom, X_cont, Y, config,iterative=False):
     while(len(context_stack) > 0):
         # print("A")
         c = context_stack.pop()
-        update_nominal_impurities(data_stats,c)
+        # Only the root can have too few samples here, new_node makes leaves of the rest
+        if(c.end-c.start < min_split):
+            c.node.ttype = TTYPE_LEAF
+            SplitterContext_dtor(c)
+            continue
+        update_nominal_impurities(data_stats,c,config.min_samples_leaf)
         # print(c.impurities[:,0],c.start,c.end)
         best_split = np.argmin(c.impurities[:,0])
         for split in [best_split]:
             # print("S", split)
 
-            inds_l, inds_r, y_counts_l, y_counts_r, imp_tot, imp_l, imp_r, val = \
+            mid, y_counts_l, y_counts_r, imp_tot, imp_l, imp_r, val = \
                 extract_nominal_split_info(data_stats, c, split)
 
             # print("S1", split)
@@ -603,15 +610,15 @@ def fit_tree(X_nom, X_cont, Y, config,iterative=False):
             # if(impurity_decrease[split] <= 0.0):
             
 
-            if(c.impurity - imp_tot <= 0):
+            if(c.impurity - imp_tot <= config.min_impurity_decrease):
                 c.node.ttype = TTYPE_LEAF
 
             else:
                 # print("S2", split)
                 ptr = _pointer_from_struct(c)
-                locs = (node_dict, nodes, context_stack, cache_nodes)
-                node_l = new_node(locs, ptr, inds_l, y_counts_l, imp_l)
-                node_r = new_node(locs, ptr, inds_r, y_counts_r, imp_r)
+                locs = (node_dict, nodes, context_stack, cache_nodes, config.max_depth, min_split)
+                node_l = new_node(locs, ptr, c.sample_inds, c.start, mid, y_counts_l, imp_l, c.depth+1)
+                node_r = new_node(locs, ptr, c.sample_inds, mid, c.end, y_counts_r, imp_r, c.depth+1)
 
                 split_data = SplitData(u1(False),i4(split), i4(val), i4(node_l), i4(node_r))
                 #np.array([split, val, node_l, node_r, -1],dtype=np.int32)
@@ -627,6 +634,189 @@ def fit_tree(X_nom, X_cont, Y, config,iterative=False):
     # print("DONE")
     return Tree(nodes,data_stats.u_ys)
 
+# update_nominal_impurities recompiled with parallel=True so that its prange over features
+#  runs on multiple threads. Each feature only touches its own split cache and row of 
+#  impurities so the resulting trees are identical to the serial ones.
+update_nominal_impurities_parallel = compile_variant(update_nominal_impurities, "parallel",
+    parallel=True, cache=True)
+fit_tree_parallel_features = compile_variant(fit_tree, "parallel_features",
+    {'update_nominal_impurities' : update_nominal_impurities_parallel}, cache=True)
+
+def resolve_n_jobs(n_jobs):
+    '''Returns the number of threads to use for 'n_jobs', where -1 means all of them.'''
+    if(n_jobs == -1): return config.NUMBA_NUM_THREADS
+    return min(n_jobs, config.NUMBA_NUM_THREADS)
+
+######### Incremental Fitting #########
+
+# An IncrementalTree keeps the SplitterContext of every node alive after fitting so that
+#  the counts held in their NominalSplitCaches can be updated one sample at a time. Unlike
+#  in fit_tree each context owns its 'sample_inds' which holds all 'end' samples in its node,
+#  and 'start' is the number of those that have been counted into the caches so far.
+incremental_tree_fields = [
+    ('data_stats', DataStatsType),
+    ('nodes', ListType(TN)),
+    # The context of each node, indexed by node id
+    ('contexts', ListType(SplitterContextType)),
+    # The number of nodes no longer reachable because their subtree was regrown
+    ('n_orphans', i8),
+]
+
+IncrementalTree, IncrementalTreeType = define_structref("IncrementalTree",incremental_tree_fields, define_constructor=False)
+
+@njit(cache=True)
+def _new_incremental_node(it, sample_inds, y_counts, impurity):
+    node_id = i4(len(it.nodes))
+    ttype = TTYPE_NODE if impurity > 0.0 else TTYPE_LEAF
+    node = TreeNode_ctor(ttype, node_id, y_counts)
+    it.nodes.append(node)
+    c = SplitterContext_ctor(0, node, sample_inds, 0, len(sample_inds), y_counts, impurity)
+    it.contexts.append(c)
+    return node_id
+
+@njit(cache=True)
+def IncrementalTree_ctor(X, Y_inds, u_ys):
+    st = new(IncrementalTreeType)
+    ds = new(DataStatsType)
+    ds.X = X
+    ds.Y = Y_inds
+    n_vals = np.zeros(X.shape[1],dtype=np.int32)
+    for j in range(X.shape[1]):
+        if(len(X) > 0): n_vals[j] = np.max(X[:,j])+1
+    ds.n_vals = n_vals
+    ds.n_classes = len(u_ys)
+    ds.u_ys = u_ys
+    y_counts = np.zeros(len(u_ys),dtype=np.uint32)
+    for y in Y_inds: y_counts[y] += 1
+    ds.y_counts = y_counts
+    ds.n_samples = len(Y_inds)
+    ds.n_features = X.shape[1]
+    st.data_stats = ds
+    st.nodes = List.empty_list(TN)
+    st.contexts = List.empty_list(SplitterContextType)
+    st.n_orphans = 0
+
+    sample_inds = np.arange(len(Y_inds),dtype=np.uint32)
+    _new_incremental_node(st, sample_inds, y_counts.copy(), gini(len(Y_inds),y_counts))
+    grow_subtree(st, st.contexts[0])
+    return st
+
+@njit(cache=True)
+def grow_subtree(it, root_c):
+    '''(Re)grows the subtree under the node of context 'root_c' from its samples'''
+    ds = it.data_stats
+    stack = List.empty_list(SplitterContextType)
+    stack.append(root_c)
+    while(len(stack) > 0):
+        c = stack.pop()
+        node = c.node
+        node.split_data = List.empty_list(SplitDataType)
+        node.op_enum = OP_NOP
+        node.ttype = TTYPE_LEAF
+
+        # Pure nodes are leaves, their caches are only counted once they need to split
+        if(c.impurity <= 0.0): continue
+
+        update_nominal_impurities(ds, c)
+        c.start = c.end
+        split = np.argmin(c.impurities[:,0])
+        imp_tot, imp_l, imp_r = c.impurities[split,0], c.impurities[split,1], c.impurities[split,2]
+        if(c.impurity - imp_tot <= 0): continue
+
+        splt_c = _struct_from_pointer(NominalSplitCacheType, c.nominal_split_cache_ptrs[split])
+        val = splt_c.best_v
+        # The children's counts are updated independently of this node's cache
+        y_counts_r = splt_c.y_counts_per_v[val].copy()
+        y_counts_l = c.y_counts - y_counts_r
+
+        # Each child gets its own copy of its samples
+        n_r = np.sum(y_counts_r)
+        inds_l = np.empty(c.end-n_r, dtype=np.uint32)
+        inds_r = np.empty(n_r, dtype=np.uint32)
+        p_l, p_r = 0, 0
+        for k in range(c.end):
+            ind = c.sample_inds[k]
+            if(ds.X[ind, split] == val):
+                inds_r[p_r] = ind; p_r += 1
+            else:
+                inds_l[p_l] = ind; p_l += 1
+
+        node_l = _new_incremental_node(it, inds_l, y_counts_l, imp_l)
+        node_r = _new_incremental_node(it, inds_r, y_counts_r, imp_r)
+        stack.append(it.contexts[node_l])
+        stack.append(it.contexts[node_r])
+
+        node.ttype = TTYPE_NODE
+        node.split_data.append(SplitData(u1(False),i4(split), i4(val), i4(node_l), i4(node_r)))
+        node.op_enum = OP_EQ
+
+@njit(cache=True)
+def _orphan_subtree(it, node_id):
+    '''Releases the caches of the nodes under nodes[node_id] (but not itself)'''
+    stack = List.empty_list(i4)
+    for sd in it.nodes[node_id].split_data:
+        stack.append(sd.left); stack.append(sd.right)
+    while(len(stack) > 0):
+        n_id = stack.pop()
+        for sd in it.nodes[n_id].split_data:
+            stack.append(sd.left); stack.append(sd.right)
+        c = it.contexts[n_id]
+        SplitterContext_dtor(c)
+        c.nominal_split_cache_ptrs = np.zeros((0,),dtype=np.int64)
+        c.sample_inds = np.empty((0,),dtype=np.uint32)
+        it.n_orphans += 1
+
+@njit(cache=True)
+def ifit_tree(it, X, Y_inds):
+    '''Adds the last sample in X and Y_inds to the tree. The class counts and split caches
+        of the nodes along its path are updated and the subtree is only regrown under the
+        first node whose best split changes. X and Y_inds must hold all previous samples.'''
+    ds = it.data_stats
+    i = len(Y_inds)-1
+    y = Y_inds[i]
+    ds.X = X
+    ds.Y = Y_inds
+    ds.n_samples = len(Y_inds)
+    ds.y_counts[y] += 1
+    for j in range(X.shape[1]):
+        ds.n_vals[j] = max(ds.n_vals[j], X[i,j]+1)
+
+    node_id = 0
+    while(True):
+        c = it.contexts[node_id]
+
+        # Append the new sample to the node's samples
+        if(c.end >= len(c.sample_inds)):
+            new_inds = np.empty(max(2*len(c.sample_inds),8),dtype=np.uint32)
+            new_inds[:c.end] = c.sample_inds[:c.end]
+            c.sample_inds = new_inds
+        c.sample_inds[c.end] = i
+        c.end += 1
+        c.y_counts[y] += 1
+        c.impurity = gini(c.end, c.y_counts)
+
+        node = c.node
+        if(node.ttype == TTYPE_NODE):
+            # If the best split is unchanged then just follow the sample down the tree
+            update_nominal_impurities(ds, c)
+            c.start = c.end
+            split = np.argmin(c.impurities[:,0])
+            sd = node.split_data[0]
+            splt_c = _struct_from_pointer(NominalSplitCacheType, c.nominal_split_cache_ptrs[split])
+            if(split == sd.split_ind and splt_c.best_v == sd.val and
+               c.impurity - c.impurities[split,0] > 0):
+                node_id = sd.right if X[i,split] == sd.val else sd.left
+                continue
+            _orphan_subtree(it, node_id)
+        elif(c.impurity <= 0.0):
+            break
+        grow_subtree(it, c)
+        break
+
+@njit(cache=True)
+def incremental_tree_to_tree(it):
+    return Tree(it.nodes, it.data_stats.u_ys)
+
             
 
 ######### Prediction Choice Functions #########
@@ -773,6 +963,109 @@ def predict_tree(tree, x_nom, x_cont, config):#, pred_choice_enum, positive_clas
 
 
 
+@njit(nogil=True, cache=True)
+def freeze_tree(tree):
+    '''Copies a fitted Tree into a FrozenTree'''
+    nodes = tree.nodes
+    n_nodes, n_classes = len(nodes), len(tree.u_ys)
+    ttype = np.empty((n_nodes,),dtype=np.uint8)
+    op = np.empty((n_nodes,),dtype=np.uint8)
+    split_starts = np.empty((n_nodes+1,),dtype=np.int32)
+    leaf_value = np.full((n_nodes,),-1,dtype=np.int32)
+    counts = np.empty((n_nodes, n_classes),dtype=np.uint32)
+
+    split_starts[0] = 0
+    for i, node in enumerate(nodes):
+        split_starts[i+1] = split_starts[i] + len(node.split_data)
+
+    n_splits = split_starts[n_nodes]
+    is_continous = np.empty((n_splits,),dtype=np.uint8)
+    feature = np.empty((n_splits,),dtype=np.int32)
+    val = np.empty((n_splits,),dtype=np.int32)
+    left = np.empty((n_splits,),dtype=np.int32)
+    right = np.empty((n_splits,),dtype=np.int32)
+    for i, node in enumerate(nodes):
+        ttype[i] = node.ttype
+        op[i] = node.op_enum
+        counts[i] = node.counts
+        if(node.ttype == TTYPE_LEAF): leaf_value[i] = np.argmax(node.counts)
+        for k, sd in enumerate(node.split_data):
+            s = split_starts[i]+k
+            is_continous[s], feature[s], val[s] = sd.is_continous, sd.split_ind, sd.val
+            left[s], right[s] = sd.left, sd.right
+
+    return FrozenTree(ttype, op, split_starts, is_continous, feature, val,
+                      left, right, leaf_value, counts, tree.u_ys)
+
+
+@njit(nogil=True, cache=True)
+def predict_frozen_tree(tree, x_nom, x_cont, config):
+    '''Same as predict_tree but for a FrozenTree'''
+    L = max(len(x_nom),len(x_cont))
+    out = np.empty((L,),dtype=np.int64)
+    n_nodes = len(tree.ttype)
+
+    # Nodes left to visit and the nodes visited so far. The visited flags are reset after 
+    #  each sample by going back through 'visited' instead of clearing the whole mask.
+    to_visit = np.empty((n_nodes,),dtype=np.int32)
+    visited = np.empty((n_nodes,),dtype=np.int32)
+    visited_mask = np.zeros((n_nodes,),dtype=np.uint8)
+    for i in range(L):
+        leafs = List.empty_list(u4_arr)
+        to_visit[0], visited[0], visited_mask[0] = 0, 0, 1
+        n_to_visit, n_visited = 1, 1
+        while n_to_visit > 0:
+            n_to_visit -= 1
+            ind = to_visit[n_to_visit]
+            if(tree.ttype[ind] == TTYPE_NODE):
+                for s in range(tree.split_starts[ind], tree.split_starts[ind+1]):
+                    # Only nominal splits are made for now (see predict_tree)
+                    if(x_nom[i,tree.feature[s]] == tree.val[s]):
+                        _n = tree.right[s]
+                    else:
+                        _n = tree.left[s]
+                    if(not visited_mask[_n]):
+                        visited_mask[_n] = 1
+                        visited[n_visited] = _n
+                        to_visit[n_to_visit] = _n
+                        n_visited += 1; n_to_visit += 1
+            else:
+                leafs.append(tree.counts[ind])
+
+        for k in range(n_visited):
+            visited_mask[visited[k]] = 0
+
+        out_i = pred_choice_func(leafs, config)
+        out[i] = tree.u_ys[out_i]
+    return out
+
+
+@njit(nogil=True, cache=True)
+def predict_frozen_tree_single(tree, x_nom, x_cont, out, config):
+    '''Predicts into 'out' by following the one path from the root to a leaf for
+        each sample. Valid since fit_tree only makes one split per node.'''
+    for i in prange(len(out)):
+        ind = 0
+        while tree.ttype[ind] == TTYPE_NODE:
+            s = tree.split_starts[ind]
+            if(x_nom[i,tree.feature[s]] == tree.val[s]):
+                ind = tree.right[s]
+            else:
+                ind = tree.left[s]
+
+        # Equivalent to pred_choice_func for a sample that ends up in one leaf
+        out_i = tree.leaf_value[ind]
+        if(config.pred_choice_enum == PRED_CHOICE_majority_general or 
+           config.pred_choice_enum == PRED_CHOICE_pure_majority_general):
+            out_i = 1 if out_i == config.positive_class else 0
+        out[i] = tree.u_ys[out_i]
+    return out
+
+# Rows are independent so predicting in parallel just needs the prange enabled
+predict_frozen_tree_single_parallel = compile_variant(predict_frozen_tree_single, "parallel",
+    parallel=True, cache=True)
+
+
 def str_op(op_enum):
     if(op_enum == OP_EQ):
         return "=="
@@ -830,7 +1123,13 @@ tree_classifier_presets = {
         "secondary_criterion" : 0,
         "secondary_total_func" : 0,
         'sep_nan' : True,
-        'cache_nodes' : False
+        'cache_nodes' : False,
+        'max_depth' : None,
+        'min_samples_split' : 2,
+        'min_samples_leaf' : 1,
+        'min_impurity_decrease' : 0.0,
+        'parallel' : 'none',
+        'n_jobs' : -1
     },
     'decision_tree_weighted_gini' : {
         'criterion' : 'weighted_gini',
@@ -841,7 +1140,13 @@ tree_classifier_presets = {
         "secondary_criterion" : 0,
         "secondary_total_func" : 0,
         'sep_nan' : True,
-        'cache_nodes' : False
+        'cache_nodes' : False,
+        'max_depth' : None,
+        'min_samples_split' : 2,
+        'min_samples_leaf' : 1,
+        'min_impurity_decrease' : 0.0,
+        'parallel' : 'none',
+        'n_jobs' : -1
     },
     'decision_tree_w_greedy_backup' : {
         'criterion' : 'gini',
@@ -852,7 +1157,13 @@ tree_classifier_presets = {
         "secondary_criterion" : 'prop_neg',
         "secondary_total_func" : 'min',
         'sep_nan' : True,
-        'cache_nodes' : False
+        'cache_nodes' : False,
+        'max_depth' : None,
+        'min_samples_split' : 2,
+        'min_samples_leaf' : 1,
+        'min_impurity_decrease' : 0.0,
+        'parallel' : 'none',
+        'n_jobs' : -1
     },
     'ambiguity_tree' : {
         'criterion' : 'weighted_gini',
@@ -863,7 +1174,13 @@ tree_classifier_presets = {
         "secondary_criterion" : 0,
         "secondary_total_func" : 0,
         'sep_nan' : True,
-        'cache_nodes' : True
+        'cache_nodes' : True,
+        'max_depth' : None,
+        'min_samples_split' : 2,
+        'min_samples_leaf' : 1,
+        'min_impurity_decrease' : 0.0,
+        'parallel' : 'none',
+        'n_jobs' : -1
     },
     'greedy_cover_tree' : {
         'criterion' : 'prop_neg',
@@ -874,7 +1191,13 @@ tree_classifier_presets = {
         "secondary_total_func" : 0,
         'positive_class' : 1,
         'sep_nan' : True,
-        'cache_nodes' : False
+        'cache_nodes' : False,
+        'max_depth' : None,
+        'min_samples_split' : 2,
+        'min_samples_leaf' : 1,
+        'min_impurity_decrease' : 0.0,
+        'parallel' : 'none',
+        'n_jobs' : -1
     }
 
 
@@ -888,13 +1211,22 @@ config_fields = [
     ('cache_nodes', types.Any),
     ('sep_nan', types.Any),
     ('positive_class', i4),
+    ('max_depth', i8),
+    ('min_samples_split', i8),
+    ('min_samples_leaf', i8),
+    ('min_impurity_decrease', f8),
 ]
 
 TreeClassifierConfig, TreeClassifierConfigTemplate = define_structref_template("TreeClassifierConfig", config_fields, define_constructor=False)
 
 @njit(cache=True)
-def new_config(typ):
-    return new(typ)
+def new_config(typ, max_depth, min_samples_split, min_samples_leaf, min_impurity_decrease):
+    st = new(typ)
+    st.max_depth = max_depth
+    st.min_samples_split = min_samples_split
+    st.min_samples_leaf = min_samples_leaf
+    st.min_impurity_decrease = min_impurity_decrease
+    return st
 
 class TreeClassifier(object):
     def __init__(self,preset_type='decision_tree', 
@@ -912,26 +1244,46 @@ class TreeClassifier(object):
             secondary_total_func: The name of the secondary total_func, defaults to 'sum'
             positive_class: The integer id for the positive class (used in prediction)
             sep_nan: If set to True then use a ternary tree that treats nan's seperately 
+            max_depth: If not None then nodes at this depth (the root is at 0) become leaves.
+            min_samples_split: Nodes with fewer samples than this become leaves.
+            min_samples_leaf: Splits must leave at least this many samples on each side.
+            min_impurity_decrease: Splits must decrease impurity by more than this.
+              The above four are only applied by fit() not ifit().
+            parallel: 'none' or 'features'. If 'features' then the candidate splits on 
+              each feature are evaluated on multiple threads. The tree is the same either way.
+            n_jobs: The number of threads used when parallel isn't 'none', -1 uses all of them.
         '''
         kwargs = {**tree_classifier_presets[preset_type], **kwargs}
 
         criterion, total_func, split_choice, pred_choice, secondary_criterion, \
-         secondary_total_func, positive_class, sep_nan, cache_nodes = \
+         secondary_total_func, positive_class, sep_nan, cache_nodes, max_depth, \
+         min_samples_split, min_samples_leaf, min_impurity_decrease, parallel, n_jobs = \
             itemgetter('criterion', 'total_func', 'split_choice', 'pred_choice', 
                 "secondary_criterion", 'secondary_total_func', 'positive_class',
-                'sep_nan', 'cache_nodes')(kwargs)
+                'sep_nan', 'cache_nodes', 'max_depth', 'min_samples_split', 
+                'min_samples_leaf', 'min_impurity_decrease', 'parallel', 'n_jobs')(kwargs)
 
         g = globals()
         criterion_enum = g.get(f"CRITERION_{criterion}",None)
         # total_enum = g.get(f"TOTAL_{total_func}",None)
         split_choice_enum = g.get(f"SPLIT_CHOICE_{split_choice}",None)
         pred_choice_enum = g.get(f"PRED_CHOICE_{pred_choice}",None)
+        parallel_enum = g.get(f"PARALLEL_{parallel}",None)
 
         if(criterion_enum is None): raise ValueError(f"Invalid criterion {criterion}")
         # if(total_enum is None): raise ValueError(f"Invalid criterion {total_func}")
         if(split_choice_enum is None): raise ValueError(f"Invalid split_choice {split_choice}")
         if(pred_choice_enum is None): raise ValueError(f"Invalid pred_choice {pred_choice}")
+        if(parallel_enum is None): raise ValueError(f"Invalid parallel {parallel}")
+        if(n_jobs != -1 and n_jobs < 1): raise ValueError(f"Invalid n_jobs {n_jobs}, must be -1 or at least 1")
+        if(max_depth is not None and max_depth < 1): raise ValueError(f"Invalid max_depth {max_depth}, must be None or at least 1")
+        if(min_samples_split < 2): raise ValueError(f"Invalid min_samples_split {min_samples_split}, must be at least 2")
+        if(min_samples_leaf < 1): raise ValueError(f"Invalid min_samples_leaf {min_samples_leaf}, must be at least 1")
+        if(min_impurity_decrease < 0.0): raise ValueError(f"Invalid min_impurity_decrease {min_impurity_decrease}, must be at least 0")
+        if(max_depth is None): max_depth = 0
         self.positive_class = positive_class
+        self.parallel_enum = parallel_enum
+        self.n_jobs = n_jobs
 
         config_dict = {k:v for k,v in config_fields}
         config_dict['criterion_enum'] = literal(criterion_enum)
@@ -946,8 +1298,11 @@ class TreeClassifier(object):
 
         
 
-        self.config = new_config(ConfigType)
+        self.config = new_config(ConfigType, max_depth, min_samples_split, 
+            min_samples_leaf, float(min_impurity_decrease))
         self.tree = None
+        self.frozen_tree = None
+        self.incremental_tree = None
 
         # @njit(cache=True)
         # def _fit(xb,xc,y,miss_mask,ft_weights): 
@@ -1002,7 +1357,43 @@ class TreeClassifier(object):
         # assert miss_mask.shape == xc.shape
 
         # self.tree = self._fit(xb, xc, y, miss_mask, ft_weights)
-        self.tree = fit_tree(X_nom, X_cont, Y, self.config, False)
+        if(self.parallel_enum != PARALLEL_none):
+            n_threads = numba.get_num_threads()
+            numba.set_num_threads(resolve_n_jobs(self.n_jobs))
+            try:
+                self.tree = fit_tree_parallel_features(X_nom, X_cont, Y, self.config, False)
+            finally:
+                numba.set_num_threads(n_threads)
+        else:
+            self.tree = fit_tree(X_nom, X_cont, Y, self.config, False)
+        self.frozen_tree = freeze_tree(self.tree)
+        self.incremental_tree = None
+
+    def ifit(self, X_nom, Y):
+        '''Updates the tree with the last sample in X_nom and Y. X_nom and Y must hold 
+            every sample that the tree has been fit on, with the new one added at the end. 
+            Only the nodes along the new sample's path are updated, see ifit_tree. The tree 
+            is grown from scratch if the number of features or classes changes.'''
+        X_nom = np.asarray(X_nom, dtype=np.int32)
+        y = Y[-1]
+        it = self.incremental_tree
+        if(it is None or len(Y) != it.data_stats.n_samples+1 or
+           X_nom.shape[1] != it.data_stats.n_features or y not in it.data_stats.u_ys or
+           it.n_orphans > len(it.nodes)//2):
+            # Keep the class index of each sample in a buffer with room to grow
+            u_ys = np.unique(Y).astype(np.int32)
+            self._Y_inds = np.empty(max(2*len(Y),8), dtype=np.int32)
+            self._Y_inds[:len(Y)] = np.searchsorted(u_ys, Y)
+            it = self.incremental_tree = IncrementalTree_ctor(X_nom, self._Y_inds[:len(Y)], u_ys)
+        else:
+            n = len(Y)
+            if(n > len(self._Y_inds)):
+                self._Y_inds = np.concatenate([self._Y_inds, np.empty_like(self._Y_inds)])
+            self._Y_inds[n-1] = np.searchsorted(it.data_stats.u_ys, y)
+            ifit_tree(it, X_nom, self._Y_inds[:n])
+        self.tree = incremental_tree_to_tree(it)
+        # Frozen on the next call to predict() 
+        self.frozen_tree = None
 
     # def inf_gain(self,xb,xc,y,miss_mask=None, ft_weights=None):
     #     if(xb is None): xb = np.empty((0,0), dtype=np.uint8)
@@ -1018,14 +1409,43 @@ class TreeClassifier(object):
     #     return self._inf_gain(xb, xc, y, miss_mask, ft_weights)
 
 
-    def predict(self, X_nom, X_cont, positive_class=None):
+    def predict(self, X_nom, X_cont, positive_class=None, out=None, n_jobs=1):
+        '''Predicts the class of each row of X_nom and X_cont. If 'out' is given the 
+            predictions are written into it (must be an int64 array of length n_rows).
+            If 'n_jobs' isn't 1 the rows are split across that many threads (-1 for all).'''
         if(self.tree is None): raise RuntimeError("TreeClassifier must be fit before predict() is called.")
+        if(self.frozen_tree is None): self.frozen_tree = freeze_tree(self.tree)
         if(positive_class is None): positive_class = self.positive_class
         if(X_nom is None): X_nom = np.empty((0,0), dtype=np.int32)
         if(X_cont is None): X_cont = np.empty((0,0), dtype=np.float32)
         X_nom = X_nom.astype(np.int32)
         X_cont = X_cont.astype(np.float32)
-        return predict_tree(self.tree,X_nom, X_cont,self.config)
+        L = max(len(X_nom),len(X_cont))
+        if(out is None): out = np.empty((L,), dtype=np.int64)
+        if(out.shape != (L,) or out.dtype != np.int64): 
+            raise ValueError(f"out must be an int64 array of shape ({L},)")
+        if(n_jobs != 1):
+            if(n_jobs < 1 and n_jobs != -1): raise ValueError(f"Invalid n_jobs {n_jobs}, must be -1 or at least 1")
+            n_threads = numba.get_num_threads()
+            numba.set_num_threads(resolve_n_jobs(n_jobs))
+            try:
+                return predict_frozen_tree_single_parallel(self.frozen_tree, X_nom, X_cont, out, self.config)
+            finally:
+                numba.set_num_threads(n_threads)
+        return predict_frozen_tree_single(self.frozen_tree, X_nom, X_cont, out, self.config)
+
+    def predict_chunks(self, chunks, positive_class=None, n_jobs=1):
+        '''Yields the predictions for each (X_nom, X_cont) block in the iterable 'chunks'. 
+            The GIL is released while predicting, so each block is predicted on a background
+            thread while the next one is pulled from 'chunks'. At most two blocks are
+            held at a time.'''
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = None
+            for X_nom, X_cont in chunks:
+                future = pool.submit(self.predict, X_nom, X_cont, positive_class, None, n_jobs)
+                if(pending is not None): yield pending.result()
+                pending = future
+            if(pending is not None): yield pending.result()
         # return self._predict(self.tree, xb, xc, positive_class)
 
     def __str__(self):
@@ -1177,6 +1597,9 @@ print(dt.predict(X, X_cont)) #predict_tree(tree,X, X_cont, PRED_CHOICE_majority)
 
 
 
+# The maximum number of encoded states that DecisionTree2 keeps cached
+STATE_CACHE_SIZE = 1 << 16
+
 # class DecisionTree2(TreeClassifier):
 class DecisionTree2(object):
     # def __init__(self, impl="decision_tree", use_missing=False):
@@ -1194,13 +1617,25 @@ class DecisionTree2(object):
 
         
         self.impl = impl
-        self.X = []
         self.y = []
         self.slots = {}
         self.inverse = []
         self.slots_count = 0
-        self.X_list = []
+        self.Y_buffer = np.empty((0,),dtype=np.int64)
         self.use_missing = use_missing
+
+        # Encoded states are written into a buffer with spare rows and columns which
+        #  doubles in either direction when full. self.X is a view of its filled part.
+        self.n_rows = 0
+        self.X_buffer = np.empty((0,0), dtype=np.uint8 if self.is_onehot else np.int32)
+        self.X = self.X_buffer
+
+        # The column of each key (for integer encoding) and the '!key' slot of 
+        #  each key (for one-hot encoding)
+        self.key_cols = {}
+        self.missing_slots = []
+        # The encoded (cols, vals) of recently seen states keyed by their items
+        self.state_cache = {}
         
 
     def _designate_new_slots(self,x):
@@ -1209,8 +1644,11 @@ class DecisionTree2(object):
             if(k not in self.slots):
                 slot = self.slots_count if self.is_onehot else 0
                 vocab = self.slots[k] = {chr(0) : slot}         
+                self.key_cols[k] = len(self.key_cols)
+                if(self.is_onehot): self.missing_slots.append(slot)
                 self.slots_count += 1
                 self.inverse.append(f'!{k}')
+                self.state_cache.clear()
             else:
                 vocab = self.slots[k]
 
@@ -1219,34 +1657,61 @@ class DecisionTree2(object):
                 vocab[v] = slot
                 self.slots_count += 1
                 self.inverse.append(f'{k}=={v}')
+                self.state_cache.clear()
 
-    def _dict_to_onehot(self,x,silent_fail=False):
-        x_new = [0]*self.slots_count
-        for k, vocab in self.slots.items():
-            # print(k, vocab)
-            val = x.get(k,chr(0))
-            if(silent_fail):
-                if(val in vocab): x_new[vocab[val]] = 1
-            else:
-                x_new[vocab[val]] = 1
-        return np.asarray(x_new,dtype=np.bool)
-
-    def _dict_to_integer(self,x,silent_fail=False):
-        x_new = [0]*len(self.slots)
-        for i,(k, vocab) in enumerate(self.slots.items()):
-            # print(k, vocab)
-            val = x.get(k,chr(0))
-            if(silent_fail):
-                if(val in vocab): x_new[i] = vocab[val]
-            else:
-                x_new[i] = vocab[val]
-        return np.asarray(x_new,dtype=np.int32)
+    def _state_entries(self,x,silent_fail=False):
+        '''Returns the (cols, vals) that the state 'x' sets on top of an encoded row 
+            where every key is missing. Encodings are cached until new slots are made.'''
+        state_key = frozenset(x.items())
+        entries = self.state_cache.get(state_key, None)
+        if(entries is not None): return entries
 
-    def _transform_dict(self,x,silent_fail=False):
+        cols, vals = [], []
+        for k, v in x.items():
+            vocab = self.slots.get(k, None)
+            if(vocab is None or v not in vocab):
+                if(silent_fail): 
+                    if(vocab is not None and self.is_onehot):
+                        cols.append(vocab[chr(0)]); vals.append(0)
+                    continue
+                raise KeyError(f"No slot for {k}=={v}.")
+            if(self.is_onehot):
+                cols.append(vocab[chr(0)]); vals.append(0)
+                cols.append(vocab[v]); vals.append(1)
+            else:
+                cols.append(self.key_cols[k]); vals.append(vocab[v])
+
+        if(len(self.state_cache) >= STATE_CACHE_SIZE): self.state_cache.clear()
+        entries = self.state_cache[state_key] = (np.asarray(cols,dtype=np.int64), np.asarray(vals,dtype=np.int32))
+        return entries
+
+    def _encode_states(self,X,out,widths=None,silent_fail=False):
+        '''Encodes the list of states 'X' into the rows of 'out'. If 'widths' is given 
+            then only the first widths[i] columns of row i are written, the rest are
+            left as missing. Each state's entries are gathered into one set of COO 
+            arrays so that the whole matrix is written in a single scatter.'''
+        n, width = out.shape
+        out[:] = 0
         if(self.is_onehot):
-            return self._dict_to_onehot(x,silent_fail)
-        else:
-            return self._dict_to_integer(x,silent_fail)
+            out[:, np.asarray(self.missing_slots,dtype=np.int64)] = 1
+            if(widths is not None):
+                out[np.arange(width)[None,:] >= widths[:,None]] = 2 if self.use_missing else 0 # missing
+        if(n == 0): return out
+
+        entries = [self._state_entries(x,silent_fail) for x in X]
+        lens = np.fromiter((len(c) for c,_ in entries), dtype=np.int64, count=n)
+        rows = np.repeat(np.arange(n), lens)
+        cols = np.concatenate([c for c,_ in entries])
+        vals = np.concatenate([v for _,v in entries])
+        out[rows, cols] = vals
+        return out
+
+    def _transform_dict(self,x,silent_fail=False,out=None):
+        '''Encodes the state 'x', if 'out' is given the encoding is written into it'''
+        if(out is None): 
+            out = np.empty(self._width(), dtype=np.bool if self.is_onehot else np.int32)
+        self._encode_states([x], out[None,:], silent_fail=silent_fail)
+        return out
 
     # def _gen_feature_weights(self, strength=1.0):
     #     weights = [0]*(self.slots_count if self.x_format == "one_hot" else len(self.slots))
@@ -1260,56 +1725,60 @@ class DecisionTree2(object):
     #     return np.asarray(weights,dtype=np.float64)
 
 
-    def _compose_one_hots(self):
-        X = np.empty( (len(self.X_list), self.slots_count), dtype=np.uint8)
-        missing_vals = [None]*len(self.X_list)
-        for i, one_hot_x in enumerate(self.X_list):
-            X[i,:len(one_hot_x)] = one_hot_x
-            X[i,len(one_hot_x):] = 2 if self.use_missing else 0 # missing
-        return X
-
-    def _compose_integers(self):
-        X = np.empty( (len(self.X_list), len(self.slots)), dtype=np.int32)
-        # missing_vals = [None]*len(self.X_list)
-        for i, int_x in enumerate(self.X_list):
-            X[i,:len(int_x)] = int_x
-            X[i,len(int_x):] = 0
-        return X
-
-
-    
-
-    def _compose(self):
-        if(self.x_format == 'one_hot'):
-            return self._compose_one_hots()
-        else:
-            return self._compose_integers()
-
-
-
-
+    def _width(self):
+        return self.slots_count if self.is_onehot else len(self.slots)
+
+    def _reserve(self, n_rows, width):
+        '''Makes room in X_buffer for n_rows x width, doubling its capacity in the
+            dimensions that are too small. Spare cells are filled with the value that
+            marks a feature as missing, so rows written before a slot existed don't 
+            need to be revisited when the width grows.'''
+        cap_rows, cap_width = self.X_buffer.shape
+        if(n_rows <= cap_rows and width <= cap_width): return
+        if(n_rows > cap_rows): cap_rows = max(2*cap_rows, n_rows, 8)
+        if(width > cap_width): cap_width = max(2*cap_width, width, 8)
+        fill = 2 if (self.is_onehot and self.use_missing) else 0 # missing
+        new_buffer = np.full((cap_rows, cap_width), fill, dtype=self.X_buffer.dtype)
+        old_rows, old_width = self.X_buffer.shape
+        new_buffer[:old_rows, :old_width] = self.X_buffer
+        self.X_buffer = new_buffer
+
+    def _append_state(self, x):
+        '''Encodes the state 'x' straight into the next row of X_buffer'''
+        self._designate_new_slots(x)
+        width = self._width()
+        self._reserve(self.n_rows+1, width)
+        self._transform_dict(x, out=self.X_buffer[self.n_rows, :width])
+        self.n_rows += 1
+        self.X = self.X_buffer[:self.n_rows, :width]
 
     def ifit(self, x, y):
-        self._designate_new_slots(x)        
-        trans_x = self._transform_dict(x)
-
-
-        self.X_list.append(trans_x)
-        self.X = self._compose()
-
-        
+        self._append_state(x)
         self.y.append(int(y) if not isinstance(y, tuple) else y)
-        Y = np.asarray(self.y,dtype=np.int64)
 
-        self.fit(self.X,Y)
+        if(self.impl == "sklearn"):
+            self.fit(self.X,np.asarray(self.y,dtype=np.int64))
+        else:
+            # Keep the labels in a buffer with room to grow instead of rebuilding them
+            n = len(self.y)
+            if(n > len(self.Y_buffer)):
+                self.Y_buffer = np.concatenate([self.Y_buffer, np.empty(max(n,8),dtype=np.int64)])
+            self.Y_buffer[n-1] = self.y[-1]
+            self.dt.ifit(self.X, self.Y_buffer[:n])
 
     def fit(self, X, Y):
         if(not isinstance(X, np.ndarray)):
-            self.X_list = []
-            for x in X:
+            states = X
+            # Each row is encoded with only the slots that existed once it was added 
+            widths = np.empty(len(X),dtype=np.int64)
+            for i, x in enumerate(X):
                 self._designate_new_slots(x)
-                self.X_list.append(self._transform_dict(x))
-            self.X = X = self._compose()
+                widths[i] = self._width()
+            width = self._width()
+            self._reserve(len(X), width)
+            self.n_rows = len(X)
+            self.X = X = self.X_buffer[:self.n_rows, :width]
+            self._encode_states(states, X, widths)
 
         Y = np.asarray(Y,dtype=np.int64)
         # print(X)
@@ -1345,10 +1814,7 @@ class DecisionTree2(object):
         width = self.slots_count if is_onehot else len(self.slots)
         dtype = np.bool if is_onehot else np.int32
         encoded_X = np.empty((len(X), width),dtype=dtype)
-
-        for i, x in enumerate(X):
-            encoded_x = self._transform_dict(x,silent_fail=True)
-            encoded_X[i] = encoded_x
+        self._encode_states(X, encoded_X, silent_fail=True)
 
         if(self.impl == "sklearn"):
             pred = self.dt.predict(encoded_X)
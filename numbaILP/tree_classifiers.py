@@ -10,13 +10,18 @@ from numba.typed import List, Dict
 from numba.core.types import DictType,ListType, unicode_type, NamedTuple,NamedUniTuple,Tuple
 from collections import namedtuple
 import timeit
+import heapq
 from sklearn import tree as SKTree
-from numbaILP.compile_template import compile_template
+from numbaILP.compile_template import compile_template, compile_variant
 from enum import IntEnum
 from numba.pycc import CC
-from numbaILP.fnvhash import hasharray#, AKD#, akd_insert,akd_get
+from numbaILP.fnvhash import new_akd, akd_insert, akd_get, fnv1a_64_update, FNV1A_64_INIT, \
+	new_fpd, fpd_insert, fpd_get, fpd_remove, sample_keys, fingerprint, FingerprintDictType
 from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import issparse
 from numbaILP.structref import define_structref
+from numba.extending import intrinsic
 
 
 
@@ -306,10 +311,11 @@ TreeTypes_LEAF = 2
 ######### Utility Functions for Fit/Predict  #########
 
 @njit(nogil=True,fastmath=True,cache=True)
-def counts_per_binary_split(xb, y_inds, n_classes):
+def counts_per_binary_split(xb, y_inds, inds, n_classes):
 	''' 
 		Determines the number of elements of each class that would be in the resulting
 		left, right and nan nodes if a split was made at each possible binary feature.
+		Only the rows 'inds' of xb are counted.
 		Also outputs the index at which missing values stop being applicable to binary
 		features.
 	'''
@@ -325,9 +331,9 @@ def counts_per_binary_split(xb, y_inds, n_classes):
 	# has_nan = np.zeros((xb.shape[1], n_classes),dtype=np.uint32);
 	# has_nan = False
 
-	#Go through in Fortran order
-	for j in range(xb.shape[1]):
-		for i in range(xb.shape[0]):
+	#Go through in Fortran order, each feature is independent so this can run in parallel
+	for j in prange(xb.shape[1]):
+		for i in inds:
 			x_ij = xb[i,j]
 			if(x_ij):
 				if(x_ij == 1):
@@ -347,6 +353,210 @@ def counts_per_binary_split(xb, y_inds, n_classes):
 	return counts, miss_counts
 
 
+# The number of features and of samples per block in counts_impurities_per_binary_split
+BINARY_FEATURE_BLOCK = 32
+BINARY_ROW_BLOCK = 2048
+
+@njit(cache=True)
+def counts_impurities_per_binary_split(xb, y_inds, inds, n_classes, criterion_enum, pos_ind, countsPS, impurities):
+	''' 
+		Fills the first xb.shape[1] rows of countsPS and impurities with the counts and 
+		impurities of a split on each binary feature, as in get_counts_impurities. Only the
+		rows 'inds' of xb are counted. Meant for a Fortran ordered xb (see TreeClassifier.fit),
+		where the rows of one feature are contiguous. Features are counted in blocks, and each
+		block is scanned in spans of 'inds' so that the span and the classes of its samples stay
+		in cache across the block. The impurities of a block are computed right after it is 
+		counted while its counts are still in cache.
+	'''
+	n_b, n_inds = xb.shape[1], len(inds)
+
+	# Look up the class of each sample once instead of once per feature 
+	ys = np.empty((n_inds,),dtype=np.uint32)
+	for k in range(n_inds):
+		ys[k] = y_inds[inds[k]]
+
+	# Each block of features is independent so this can run in parallel
+	n_blocks = (n_b + BINARY_FEATURE_BLOCK - 1) // BINARY_FEATURE_BLOCK
+	for b in prange(n_blocks):
+		j0 = b * BINARY_FEATURE_BLOCK
+		n_j = min(BINARY_FEATURE_BLOCK, n_b - j0)
+
+		# The zero, one and missing counts of each feature in the block 
+		counts = np.zeros((3, n_j, n_classes),dtype=np.uint32)
+		for k0 in range(0, n_inds, BINARY_ROW_BLOCK):
+			k1 = min(k0 + BINARY_ROW_BLOCK, n_inds)
+			for j in range(n_j):
+				for k in range(k0, k1):
+					x_ij = xb[inds[k], j0+j]
+					counts[min(x_ij, 2), j, ys[k]] += 1
+
+		# Missing values are ignored in the impurities
+		flat_impurities = criterion_func(criterion_enum, counts[:2].reshape((-1,n_classes)), pos_ind, n_classes)
+		for j in range(n_j):
+			impurities[j0+j, 0] = flat_impurities[j]
+			impurities[j0+j, 1] = flat_impurities[n_j+j]
+			# Throw missing values into the left bin
+			countsPS[j0+j, 0] = counts[0, j] + counts[2, j]
+			countsPS[j0+j, 1] = counts[1, j]
+
+
+@njit(cache=True)
+def counts_then_impurities_per_binary_split(xb, y_inds, inds, n_classes, criterion_enum, pos_ind, countsPS, impurities):
+	'''Same as counts_impurities_per_binary_split but for formats of xb without a fused 
+		kernel. The counts come from counts_per_binary_split for the format.'''
+	n_b = xb.shape[1]
+	countsPS_n_b, miss_countsPS = counts_per_binary_split(xb, y_inds, inds, n_classes)
+	flat_impurities = criterion_func(criterion_enum, countsPS_n_b.reshape((-1,n_classes)), pos_ind, n_classes)
+	impurities[:n_b] = flat_impurities.reshape((n_b,2))
+	countsPS[:n_b] = countsPS_n_b
+
+	# Throw missing values into the left bin
+	for j in range(n_b):
+		countsPS[j,0] = countsPS[j,0] + miss_countsPS[j]
+
+
+######### Binary Feature Formats #########
+
+# Besides a dense array xb can be a CSRMatrix or a BitMatrix. Each format has its own 
+#  counts_per_binary_split, and any other code that reads xb does so through binary_value
+#  and row_slice, so that variants for each format can be compiled with compile_variant.
+
+@njit(nogil=True,cache=True,inline='always')
+def binary_value(xb, i, j):
+	return xb[i,j]
+
+@njit(nogil=True,cache=True,inline='always')
+def row_slice(xb, lo, hi):
+	return xb[lo:hi]
+
+def binary_format(xb):
+	'''Returns the name of the format of xb and xb ready to be passed to fit or predict'''
+	if(isinstance(xb, BitMatrix)): return 'bits', xb
+	if(issparse(xb)): return 'csr', to_csr_matrix(xb)
+	return 'dense', xb.astype(np.uint8)
+
+######### Sparse Binary Features #########
+
+# A binary feature matrix in CSR form. Like a dense xb each stored value is 1 (True) or 
+#  some other nonzero value (missing), and the indices of each row are sorted. 'shape' is 
+#  an array rather than a tuple since parfors can't take tuples nested in a namedtuple.
+CSRMatrix = namedtuple("CSRMatrix",['indptr','indices','data','shape'])
+
+def to_csr_matrix(x):
+	'''Converts a scipy sparse matrix into a CSRMatrix'''
+	x = x.tocsr()
+	if(not x.has_sorted_indices): x = x.sorted_indices()
+	return CSRMatrix(np.asarray(x.indptr, dtype=np.int64), np.asarray(x.indices, dtype=np.int32),
+					 np.asarray(x.data, dtype=np.uint8), np.array(x.shape, dtype=np.int64))
+
+@njit(nogil=True,fastmath=True,cache=True)
+def counts_per_binary_split_csr(xb, y_inds, inds, n_classes):
+	'''Same as counts_per_binary_split but for a CSRMatrix xb. Only the nonzeros in
+		the rows 'inds' are visited, the counts for zeros are found by subtracting the 
+		other counts of each feature from the class counts of the node.'''
+	n_b = xb.shape[1]
+	counts = np.zeros((n_b, 2, n_classes),dtype=np.uint32);
+	miss_counts = np.zeros((n_b, n_classes),dtype=np.uint32);
+	node_counts = np.zeros((n_classes,),dtype=np.uint32);
+	for i in inds:
+		y_i = y_inds[i]
+		node_counts[y_i] += 1
+		for p in range(xb.indptr[i], xb.indptr[i+1]):
+			x_ij = xb.data[p]
+			if(x_ij):
+				if(x_ij == 1):
+					counts[xb.indices[p],1,y_i] += 1;	
+				else:
+					miss_counts[xb.indices[p],y_i] += 1;
+
+	for j in range(n_b):
+		counts[j,0] = node_counts - counts[j,1] - miss_counts[j]
+	return counts, miss_counts
+
+@njit(nogil=True,cache=True,inline='always')
+def binary_value_csr(xb, i, j):
+	'''Same as binary_value but for a CSRMatrix xb, binary searches row i for j.'''
+	lo, hi = xb.indptr[i], xb.indptr[i+1]
+	p = lo + np.searchsorted(xb.indices[lo:hi], j)
+	return xb.data[p] if (p < hi and xb.indices[p] == j) else np.uint8(0)
+
+@njit(nogil=True,cache=True,inline='always')
+def row_slice_csr(xb, lo, hi):
+	'''Same as row_slice but for a CSRMatrix xb. The rows share xb's indices and data.'''
+	return CSRMatrix(xb.indptr[lo:hi+1], xb.indices, xb.data, np.array((hi-lo, xb.shape[1])))
+
+######### Bit-Packed Binary Features #########
+
+# A binary feature matrix packed into bitsets over its rows. Bit i of value_bits[j] is set if
+#  xb[i,j] is 1 and bit i of miss_bits[j] is set if it is missing. Row i is read from bit 
+#  i+row_offset, which lets row_slice_bits take a block of rows without copying.
+BitMatrix = namedtuple("BitMatrix",['value_bits','miss_bits','row_offset','shape'])
+
+def pack_bits(xb):
+	'''Packs a dense binary feature matrix (where values other than 0 and 1 are missing) 
+		into a BitMatrix. Each column is packed into uint64 words.'''
+	xb = np.asarray(xb, dtype=np.uint8)
+	n, m = xb.shape
+	n_words = (n+63)//64
+	def pack(mask):
+		bits = np.zeros((m, n_words*8), dtype=np.uint8)
+		bits[:, :(n+7)//8] = np.packbits(mask.T, axis=1, bitorder='little')
+		return np.asarray(bits.view('<u8'), dtype=np.uint64)
+	return BitMatrix(pack(xb == 1), pack(xb > 1), np.int64(0), np.array((n, m), dtype=np.int64))
+
+@intrinsic
+def popcount(typingctx, x):
+	'''The number of set bits in the integer x'''
+	if(isinstance(x, types.Integer)):
+		def codegen(context, builder, sig, args):
+			return builder.ctpop(args[0])
+		return x(x), codegen
+
+@njit(nogil=True,fastmath=True,cache=True)
+def counts_per_binary_split_bits(xb, y_inds, inds, n_classes):
+	'''Same as counts_per_binary_split but for a BitMatrix xb. The rows 'inds' of each 
+		class are marked in a bitmask, and the counts of each feature are the popcounts 
+		of its value and missing bits ANDed with each class's mask. Only the words that
+		hold some of the rows 'inds' are visited.'''
+	n_b, n_words = xb.shape[1], xb.value_bits.shape[1]
+	class_bits = np.zeros((n_words, n_classes),dtype=np.uint64)
+	word_used = np.zeros((n_words,),dtype=np.uint8)
+	node_counts = np.zeros((n_classes,),dtype=np.uint32);
+	for i in inds:
+		r = i + xb.row_offset
+		class_bits[r >> 6, y_inds[i]] |= np.uint64(1) << np.uint64(r & 63)
+		word_used[r >> 6] = 1
+		node_counts[y_inds[i]] += 1
+	words = np.nonzero(word_used)[0]
+	class_bits = class_bits[words]
+
+	counts = np.zeros((n_b, 2, n_classes),dtype=np.uint32);
+	miss_counts = np.zeros((n_b, n_classes),dtype=np.uint32);
+	for j in prange(n_b):
+		value_bits_j, miss_bits_j = xb.value_bits[j], xb.miss_bits[j]
+		for k in range(len(words)):
+			v, m = value_bits_j[words[k]], miss_bits_j[words[k]]
+			if(v | m):
+				for c in range(n_classes):
+					counts[j,1,c] += popcount(v & class_bits[k,c])
+					miss_counts[j,c] += popcount(m & class_bits[k,c])
+		counts[j,0] = node_counts - counts[j,1] - miss_counts[j]
+	return counts, miss_counts
+
+@njit(nogil=True,cache=True,inline='always')
+def binary_value_bits(xb, i, j):
+	'''Same as binary_value but for a BitMatrix xb, 1 if set and 2 if missing.'''
+	r = i + xb.row_offset
+	bit = np.uint64(1) << np.uint64(r & 63)
+	if(xb.value_bits[j, r >> 6] & bit): return np.uint8(1)
+	if(xb.miss_bits[j, r >> 6] & bit): return np.uint8(2)
+	return np.uint8(0)
+
+@njit(nogil=True,cache=True,inline='always')
+def row_slice_bits(xb, lo, hi):
+	'''Same as row_slice but for a BitMatrix xb.'''
+	return BitMatrix(xb.value_bits, xb.miss_bits, xb.row_offset+lo, np.array((hi-lo, xb.shape[1])))
+
 
 
 
@@ -392,38 +602,76 @@ def r_l_split(x, miss_mask):
 	return l[:nl], r[:nr]
 
 
-###### Array Keyed Dictionaries ######
+@njit(nogil=True,fastmath=True,cache=True)
+def partition_inplace(inds, go_right, scratch):
+	'''Stably partitions the sample indicies 'inds' in place so that the samples i with
+		go_right[i] == 0 come before the rest. 'scratch' must be at least as long as 
+		'inds'. Returns the number of samples that went left.'''
+	nl, nr = 0, 0
+	for k in range(len(inds)):
+		i = inds[k]
+		if(go_right[i]):
+			scratch[nr] = i
+			nr += 1
+		else:
+			inds[nl] = i
+			nl += 1
+	inds[nl:nl+nr] = scratch[:nr]
+	return nl
 
-BE = Tuple([u1[::1],i4])
-BE_List = ListType(BE)
+@njit(nogil=True,fastmath=True,cache=True)
+def partition_inplace_hashed(inds, go_right, scratch):
+	'''Same as partition_inplace but also returns the fnv1a_64_words hashes of the lefts 
+		and the rights, which are built up as each sample is placed.'''
+	nl, nr = 0, 0
+	h_l, h_r = FNV1A_64_INIT, FNV1A_64_INIT
+	for k in range(len(inds)):
+		i = inds[k]
+		if(go_right[i]):
+			scratch[nr] = i
+			nr += 1
+			h_r = fnv1a_64_update(h_r, i)
+		else:
+			inds[nl] = i
+			nl += 1
+			h_l = fnv1a_64_update(h_l, i)
+	inds[nl:nl+nr] = scratch[:nr]
+	return nl, h_l, h_r
 
-@njit(nogil=True,fastmath=True)
-def akd_insert(akd,_arr,item,h=None):
-	'''Inserts an i4 item into the dictionary keyed by an array _arr'''
-	arr = _arr.view(np.uint8)
-	if(h is None): h = hasharray(arr)
-	elems = akd.get(h,List.empty_list(BE))
-	is_in = False
-	for elem in elems:
-		if(len(elem[0]) == len(arr) and
-			(elem[0] == arr).all()): 
-			is_in = True
-			break
-	if(not is_in):
-		elems.append((arr,item))
-		akd[h] = elems
+@njit(nogil=True,fastmath=True,cache=True)
+def partition_inplace_fingerprinted(inds, go_right, scratch):
+	'''Same as partition_inplace but also returns the 128-bit fingerprints (see 
+		fnvhash.fingerprint) of the lefts and the rights as (lo, hi) tuples.'''
+	nl, nr = 0, 0
+	lo_l, hi_l, lo_r, hi_r = u8(0), u8(0), u8(0), u8(0)
+	for k in range(len(inds)):
+		i = inds[k]
+		k_lo, k_hi = sample_keys(i)
+		if(go_right[i]):
+			scratch[nr] = i
+			nr += 1
+			lo_r += k_lo
+			hi_r += k_hi
+		else:
+			inds[nl] = i
+			nl += 1
+			lo_l += k_lo
+			hi_l += k_hi
+	inds[nl:nl+nr] = scratch[:nr]
+	return nl, (lo_l, hi_l), (lo_r, hi_r)
+
+
+@njit(nogil=True,fastmath=True,cache=True)
+def ensure_capacity(buff, n_used, n_needed):
+	'''Returns 'buff' (or a copy of it with its first n_used columns filled in) with 
+		room for at least n_needed columns. Grows geometrically.'''
+	cap = buff.shape[-1]
+	if(n_needed <= cap): return buff
+	new_cap = max(n_needed, 2*cap)
+	new_buff = np.empty(buff.shape[:-1]+(new_cap,), dtype=buff.dtype)
+	new_buff[...,:n_used] = buff[...,:n_used]
+	return new_buff
 
-@njit(nogil=True,fastmath=True)
-def akd_get(akd,_arr,h=None):
-	'''Gets an i4 from a dictionary keyed by an array _arr'''
-	arr = _arr.view(np.uint8)
-	if(h is None): h = hasharray(arr) 
-	if(h in akd):
-		for elem in akd[h]:
-			if(len(elem[0]) == len(arr) and
-				(elem[0] == arr).all()): 
-				return elem[1]
-	return -1
 
 '''
 TreeNode: A particular node in the tree
@@ -452,20 +700,60 @@ TreeNode, TN = define_structref("TreeNode",treenode_fields)
 '''
 SplitContext: An object holding relevant local variables of the tree after a split.
 	This struct is used to avoid using recursion.
-	inds -- A list of indicies of samples which fall in the present branch of the tree.
+	start -- The start of the span of the shared 'sample_inds' buffer holding the indicies
+		of samples which fall in the present branch of the tree.
+	end -- The end of that span.
 	impurity -- The impurity of this branch of the tree.
 	counts -- The number of samples of each class.
 	parent node -- The node from which this branch was produced.
+	hist -- If binning, the per-bin class histogram of each continous feature. 
+		Otherwise an empty array.
+	fp_lo, fp_hi -- If memoizing split search, the fingerprint of the branch's samples.
+		Otherwise zeros.
+	depth -- The depth of the branch's node, the root is at depth 0.
 '''
 
-SplitContext = namedtuple("SplitContext",['inds','impurity','counts','parent_node'])
-SC = NamedTuple([u4[::1],f8,u4[::1],i4],SplitContext)
+SplitContext = namedtuple("SplitContext",['start','end','impurity','counts','parent_node','hist','fp_lo','fp_hi','depth'])
+SC = NamedTuple([i8,i8,f8,u4[::1],i4,u4[:,:,::1],u8,u8,i8],SplitContext)
 
 i4_arr = i4[:]
+u4_arr = u4[::1]
 
 
 
-Tree, TreeType = define_structref("Tree",[("nodes",ListType(TN)),('u_ys', i4[::1])])			
+# memo_hits and memo_misses count the lookups into fit_tree's SplitMemo (if it had one) 
+Tree, TreeType = define_structref("Tree",[("nodes",ListType(TN)),('u_ys', i4[::1]),
+	('memo_hits', i8), ('memo_misses', i8)])			
+
+'''
+FrozenTree: A flat array backed copy of a fitted Tree used for prediction. Avoids the 
+	pointer chasing and refcounting of walking the List of TreeNodes.
+	ttype -- The ttype of each node
+	op -- The op_enum of each node
+	split_starts -- The splits of node i are split_starts[i]:split_starts[i+1] of 
+		the per-split arrays below. Only ambiguity trees have more than one per node.
+	feature -- For each split the feature index it is made on
+	threshold -- For each split on a continous feature the threshold
+	left -- For each split the index of the node to the left
+	right -- For each split the index of the node to the right
+	leaf_value -- For each leaf the index of the class with the most samples, -1 otherwise
+	counts -- For each node the number of samples of each class falling in it
+'''
+
+frozen_tree_fields = [
+	('ttype', u1[::1]),
+	('op', u1[::1]),
+	('split_starts', i4[::1]),
+	('feature', i4[::1]),
+	('threshold', f4[::1]),
+	('left', i4[::1]),
+	('right', i4[::1]),
+	('leaf_value', i4[::1]),
+	('counts', u4[:,::1]),
+	('u_ys', i4[::1])
+]
+
+FrozenTree, FrozenTreeType = define_structref("FrozenTree",frozen_tree_fields)
 
 
 ######### Fit #########
@@ -473,19 +761,35 @@ Tree, TreeType = define_structref("Tree",[("nodes",ListType(TN)),('u_ys', i4[::1
 #NOTE: new_node is probably commented out in fit_tree and replaced by an inline implementation
 #	numba's inlining isn't quite mature enough to not take a slight performance hit.
 @njit(cache=True, locals={"NODE":i4,"LEAF":i4,'node':i4},inline='never')
-def new_node(locs, split, op, new_inds, impurities, countsPS,ind):
-	node_dict,nodes,new_contexts,cache_nodes = locs
+def new_node(locs, split, op, sample_inds, start, end, new_hist, impurities, countsPS,ind,key,depth):
+	node_dict,fp_dict,nodes,new_contexts,cache_nodes,fingerprint_nodes,max_depth,min_split = locs
 	NODE, LEAF = i4(1), i4(2) #np.array(1,dtype=np.int32).item(), np.array(2,dtype=np.int32).item()
 	node = i4(-1)
-	if (cache_nodes): node= akd_get(node_dict,new_inds)
+	# 'key' is the fingerprint of sample_inds[start:end] from partition_inplace_fingerprinted
+	#  if fingerprint_nodes or memoizing, otherwise its hash from partition_inplace_hashed
+	#  in key[0]. Either way key[0] is a hash of the samples that akd_get can use.
+	if (cache_nodes):
+		if(fingerprint_nodes):
+			node = fpd_get(fp_dict,key[0],key[1])
+			# The samples aren't kept, but a node with the same fingerprint should at least 
+			#  have the same counts
+			if(node != -1 and not (nodes[node].counts == countsPS[split,ind]).all()): node = i4(-1)
+		else:
+			node = akd_get(node_dict,sample_inds[start:end],key[0])
 	if(node == -1):
 		node = i4(len(nodes))
-		if(cache_nodes): akd_insert(node_dict,new_inds,node)
+		if(cache_nodes):
+			if(fingerprint_nodes):
+				fpd_insert(fp_dict,key[0],key[1],node)
+			else:
+				# The buffer is partitioned in place later on so the key needs to be a copy
+				akd_insert(node_dict,sample_inds[start:end].copy(),node,key[0])
 		ms_impurity = impurities[split,ind].item()
-		if(ms_impurity > 0.0):
+		# Nodes that the stopping rules would never split become leaves without a context
+		if(ms_impurity > 0.0 and (max_depth == 0 or depth < max_depth) and end-start >= min_split):
 			nodes.append(TreeNode(NODE,node,op, List.empty_list(i4_arr),countsPS[split,ind]))
-			new_contexts.append(SplitContext(new_inds,
-				ms_impurity,countsPS[split,ind], node))
+			new_contexts.append(SplitContext(start, end,
+				ms_impurity,countsPS[split,ind], node, new_hist, key[0], key[1], depth))
 		else:
 			nodes.append(TreeNode(LEAF,node,op, List.empty_list(i4_arr),countsPS[split,ind]))
 	return node
@@ -498,24 +802,256 @@ OP_ISNAN = u1(3)
 
 
 @njit(cache=True)
-def get_counts_impurities(xb, xc, y, miss_mask, base_impurity, counts, criterion_enum, total_enum, pos_ind, n_classes, sep_nan):
+def _choose_threshold(cum_counts, thresh_inds, nan_counts, has_nan, counts, miss_counts, base_impurity, criterion_enum, total_enum, pos_ind, n_classes, sep_nan):
+	'''Given the cumulative left(0) and right(1) counts at every split point of a continous 
+		feature and the candidate split points 'thresh_inds', finds the split point and 
+		operation that produces the smallest total impurity. Returns the impurities, 
+		index (-1 if there are no candidates), counts and operation of the best split.'''
+
+	# If every value is the same then just use i=0
+	best_impurity = np.zeros((2,),dtype=np.float64)
+	best_impurity[0] = base_impurity
+	best_impurity[1] = 1.0#np.inf
+	best_total_impurity, best_counts, best_op = np.inf, cum_counts[-1].copy(), OP_GE
+	best_counts[0] += nan_counts
+	best_ind = -1
+
+	for t_i in thresh_inds:
+		# We need to find the best of three choices for handling NaNs 
+		#  NOTE: can't just use >= since for all t (NaN >= t) == 0 
+	 	#  1 : (Nan|N vs Y) : x >= thresh
+		#  2 : (Nan|Y vs N) : x < thresh 
+		#  3 : (Y|N vs Nan) : np.isnan(x)
+
+		# Check (1 and 2) on every possible threshold
+		#  to see what leads to the smallest impurity
+		if(sep_nan and has_nan):
+			# Build counts for '<' and '>=", always putting NaNs in left
+			c_lt = np.empty((2, n_classes),dtype=np.uint32)
+			c_lt[0] = cum_counts[t_i,1] + nan_counts
+			c_lt[1] = cum_counts[t_i,0]
+			c_ge = np.empty((2, n_classes),dtype=np.uint32)
+			c_ge[0] = cum_counts[t_i,0] + nan_counts
+			c_ge[1] = cum_counts[t_i,1]
+
+			# Figure out which operation is better in terms of total impurity
+			impurity_lt = criterion_func(criterion_enum, c_lt, pos_ind, n_classes)
+			impurity_ge = criterion_func(criterion_enum, c_ge, pos_ind, n_classes)
+			total_impurity_lt = total_func(total_enum, impurity_lt) 
+			total_impurity_ge = total_func(total_enum, impurity_ge) 
+			if(total_impurity_lt < total_impurity_ge):
+				impurity = impurity_lt
+				total_impurity = total_impurity_lt
+				op = OP_LT 
+				split_counts = c_lt
+			else:
+				impurity = impurity_ge
+				total_impurity = total_impurity_ge
+				op = OP_GE 
+				split_counts = c_ge
+		else:
+			# When there are no NaNs or if we ignore them fallback on ">=", 
+			#  since (NaN >= t) == 0 any NaNs still end up on the left
+			split_counts = cum_counts[t_i].copy()
+			split_counts[0] += nan_counts
+			impurity = criterion_func(criterion_enum, split_counts, pos_ind, n_classes)
+			total_impurity = total_func(total_enum, impurity)
+			op = OP_GE
+		
+		if(total_impurity < best_total_impurity):
+			# If this is the best theshold point so far mark it as such
+			best_impurity, best_total_impurity = impurity, total_impurity
+			best_ind, best_op = t_i, op
+			best_counts = split_counts
+
+	#See if using np.is_nan() would produce better results
+	if(sep_nan and has_nan):
+		#Left is non_NaN right is NaN
+		is_nan_counts = np.empty((2, n_classes),dtype=np.uint32)
+		is_nan_counts[0] = counts-(nan_counts+miss_counts)
+		is_nan_counts[1] = nan_counts
+
+		is_nan_impurity = criterion_func(criterion_enum, is_nan_counts,pos_ind, n_classes)
+		is_nan_total_impurity = total_func(total_enum, is_nan_impurity)
+		if(is_nan_total_impurity < best_total_impurity):
+			best_impurity, best_total_impurity = is_nan_impurity, is_nan_total_impurity
+			best_op = OP_ISNAN
+			best_counts = is_nan_counts
+
+	return best_impurity, best_ind, best_counts, best_op
+
+
+@njit(cache=True)
+def cont_split_sorted(xc_j, y_j, counts, miss_counts, base_impurity, criterion_enum, total_enum, pos_ind, n_classes, sep_nan):
+	'''Finds the best threshold (and operation) for splitting on a single continous feature
+		given its non-missing values 'xc_j' and labels 'y_j' already sorted by value.
+		Returns the impurities, threshold, counts and operation of the best split.'''
+
+	# NaN's end up at the end of a sort (in numpy), find where they start 
+	nan_start = len(xc_j)
+	for i in range(len(xc_j)-1,-1,-1):
+		if(not np.isnan(xc_j[i])): break
+		nan_start = i
+
+	#Find counts for NaN only bin
+	has_nan = nan_start != len(xc_j)
+	nan_counts = np.zeros((n_classes,),dtype=np.uint32)
+	for i in range(nan_start,len(xc_j)):
+		nan_counts[y_j[i]] += 1
+
+	# Find left(0) and right(1) cumulative counts for splitting at each possible threshold
+	#  i.e figure out what child counts looks like if we put the threshold inbetween
+	#  each of the sorted feature pairs.			
+	cum_counts = np.zeros((nan_start+1, 2, n_classes),dtype=np.uint32)
+	for i in range(nan_start):
+		y_ij = y_j[i]
+		cum_counts[i+1, 0] = cum_counts[i, 0]
+		cum_counts[i+1, 0, y_ij] += 1
+
+	cum_counts[:,1] = (counts-(miss_counts+nan_counts)) - cum_counts[:,0]
+
+	#Find all 'i' s.t. xc_j[i] != xc_j[i-1] (i.e. candidate pairs for threshold)
+	thresh_inds, c = np.empty((nan_start,),dtype=np.uint32), 0
+	for i in range(1, nan_start):
+		if(xc_j[i] != xc_j[i-1]):
+			thresh_inds[c] = i
+			c += 1
+
+	best_impurity, best_ind, best_counts, best_op = \
+		_choose_threshold(cum_counts, thresh_inds[:c], nan_counts, has_nan, counts, miss_counts,
+			base_impurity, criterion_enum, total_enum, pos_ind, n_classes, sep_nan)
+
+	if(best_ind != -1):
+		thresh = (xc_j[best_ind-1] + xc_j[best_ind]) / 2.0
+	else:
+		# Otherwise just use a placeholder threshold
+		thresh = np.inf
+
+	return best_impurity, thresh, best_counts, best_op
+
+
+######### Histogram Binning #########
+
+@njit(nogil=True,cache=True)
+def bin_continuous(xc, max_bins):
+	'''Quantizes each column of xc into at most 'max_bins' quantile bins. Returns the 
+		bin code of every value (NaNs get the code max_bins) and the edges between bins,
+		padded with inf. A value x falls in bin k if bin_edges[j,k-1] <= x < bin_edges[j,k].'''
+	n, n_c = xc.shape
+	codes = np.empty((n, n_c), dtype=np.uint8)
+	bin_edges = np.full((n_c, max_bins-1), np.inf, dtype=np.float64)
+	for j in range(n_c):
+		xc_j = xc[:,j]
+		vals = np.sort(xc_j[~np.isnan(xc_j)])
+		uniq = np.unique(vals)
+
+		# Put edges between distinct values, either at every pair or at quantiles
+		if(len(uniq) <= max_bins):
+			n_edges = max(len(uniq)-1,0)
+			bin_edges[j,:n_edges] = (uniq[:-1] + uniq[1:]) / 2.0
+		else:
+			n_edges = 0
+			for b in range(1, max_bins):
+				v = vals[(b * len(vals)) // max_bins]
+				k = np.searchsorted(uniq, v)
+				if(k == 0): continue
+				edge = (uniq[k-1] + uniq[k]) / 2.0
+				if(n_edges == 0 or edge > bin_edges[j,n_edges-1]):
+					bin_edges[j,n_edges] = edge
+					n_edges += 1
+
+		edges_j = bin_edges[j,:n_edges]
+		for i in range(n):
+			if(np.isnan(xc_j[i])):
+				codes[i,j] = max_bins
+			else:
+				codes[i,j] = np.searchsorted(edges_j, xc_j[i], side='right')
+	return codes, bin_edges
+
+
+@njit(nogil=True,fastmath=True,cache=True)
+def build_histogram(codes, y, miss_mask, inds, n_bins, n_classes):
+	'''Counts the classes of the samples 'inds' falling in each bin of each continous 
+		feature. The slot n_bins holds NaNs and the slot n_bins+1 holds missing values.'''
+	n_c = codes.shape[1]
+	hist = np.zeros((n_c, n_bins+2, n_classes), dtype=np.uint32)
+	has_miss = miss_mask.shape[1] > 0
+	for j in range(n_c):
+		for i in inds:
+			if(has_miss and miss_mask[i,j]):
+				hist[j,n_bins+1,y[i]] += 1
+			else:
+				hist[j,codes[i,j],y[i]] += 1
+	return hist
+
+
+@njit(nogil=True,fastmath=True,cache=True)
+def child_histograms(codes, y, miss_mask, hist, inds_l, inds_r, n_classes):
+	'''Builds the histograms of the left and right children of a split. Only the smaller 
+		child is scanned, the larger child's histogram is the parent's minus the smaller's.'''
+	if(hist.shape[0] == 0):
+		return hist, hist
+	n_bins = hist.shape[1]-2
+	if(len(inds_l) <= len(inds_r)):
+		hist_l = build_histogram(codes, y, miss_mask, inds_l, n_bins, n_classes)
+		return hist_l, hist - hist_l
+	else:
+		hist_r = build_histogram(codes, y, miss_mask, inds_r, n_bins, n_classes)
+		return hist - hist_r, hist_r
+
+
+@njit(cache=True)
+def cont_split_hist(hist_j, bin_edges_j, counts, base_impurity, criterion_enum, total_enum, pos_ind, n_classes, sep_nan):
+	'''Finds the best threshold (and operation) for splitting on a single continous feature
+		from its per-bin class histogram. Returns the impurities, threshold, counts, 
+		operation of the best split, and the counts of missing values.'''
+	n_bins = hist_j.shape[0]-2
+	nan_counts = hist_j[n_bins]
+	miss_counts = hist_j[n_bins+1]
+	has_nan = np.sum(nan_counts) > 0
+
+	# Cumulative counts for splitting at the lower edge of each bin
+	cum_counts = np.zeros((n_bins+1, 2, n_classes),dtype=np.uint32)
+	for k in range(n_bins):
+		cum_counts[k+1, 0] = cum_counts[k, 0] + hist_j[k]
+	cum_counts[:,1] = (counts-(miss_counts+nan_counts)) - cum_counts[:,0]
+
+	# Candidates are the non-empty bins that have a non-empty bin below them
+	thresh_inds, c = np.empty((n_bins,),dtype=np.uint32), 0
+	seen_nonempty = False
+	for k in range(n_bins):
+		if(np.sum(hist_j[k]) > 0):
+			if(seen_nonempty):
+				thresh_inds[c] = k
+				c += 1
+			seen_nonempty = True
+
+	best_impurity, best_ind, best_counts, best_op = \
+		_choose_threshold(cum_counts, thresh_inds[:c], nan_counts, has_nan, counts, miss_counts,
+			base_impurity, criterion_enum, total_enum, pos_ind, n_classes, sep_nan)
+
+	thresh = bin_edges_j[best_ind-1] if best_ind != -1 else np.inf
+	return best_impurity, thresh, best_counts, best_op, miss_counts
+
+
+@njit(cache=True)
+def get_counts_impurities(xb, xc, y, miss_mask, base_impurity, counts, criterion_enum, total_enum, pos_ind, n_classes, sep_nan, inds=None, srt_inds=None, hist=None, bin_edges=None):
+	'''Finds the child counts and impurities of the best split on every binary and continous
+		feature. If 'inds' is given then only those rows of xb, xc, y, and miss_mask are
+		considered, otherwise all of them are. If 'srt_inds' is given then each row srt_inds[j] 
+		holds the rows 'inds' ordered by feature j, and the continous features are scanned in 
+		that order instead of being sorted at every node. If 'hist' is given then the continous 
+		features are instead split on the edges of their bins using the node's per-bin class 
+		histograms.'''
 	#NOTE: This function assumes that the elements [i,j] of missing_values is sorted by 'j'  
+	if(inds is None): inds = np.arange(len(y), dtype=np.uint32)
 	n_b, n_c = xb.shape[1], xc.shape[1]
 	countsPS = np.empty((n_b+n_c, 2, n_classes),dtype=np.uint32)
 	impurities = np.empty((n_b+n_c, 2),dtype=np.float64)
 	ops = np.empty((n_b+n_c,),dtype=np.uint8)
 	# Handle binary case
-	countsPS_n_b, miss_countsPS = counts_per_binary_split(xb, y, n_classes)
-	countsPS[:n_b] = countsPS_n_b
-	flat_impurities = criterion_func(criterion_enum, countsPS_n_b.reshape((-1,n_classes)), pos_ind, n_classes)
-	impurities[:n_b] = flat_impurities.reshape((n_b,2))
-
+	counts_impurities_per_binary_split(xb, y, inds, n_classes, criterion_enum, pos_ind, countsPS, impurities)
 	ops[:n_b] = OP_GE
-
-	# Throw missing values into the left bin
-	for j in range(n_b):
-		countsPS[j,0] = countsPS[j,0] + miss_countsPS[j]
-	
 	
 	# Handle continous case	
 	thresholds = np.empty((n_c,),dtype=np.float64)
@@ -525,168 +1061,77 @@ def get_counts_impurities(xb, xc, y, miss_mask, base_impurity, counts, criterion
 	if(is_pure):
 		# If this node is pure then just return placeholder info
 		for j in range(n_c):
-			countsPS[j] = np.zeros((2, n_classes),dtype=np.uint32)
-			countsPS[j,0] = counts
-			thresholds[n_b +j] = np.inf
-			impurities[n_b +j] = base_impurity
+			countsPS[n_b+j] = np.zeros((2, n_classes),dtype=np.uint32)
+			countsPS[n_b+j,0] = counts
+			thresholds[j] = np.inf
+			impurities[n_b+j] = base_impurity
 			ops[n_b+j] = OP_GE
 	else:
-		# Otherwise we need to find the best threshold to split on per feature
-		for j in range(n_c):
-			# Generate and indicies along i that excludes missing values
-			miss_counts = np.zeros((n_classes,),dtype=np.uint32)
-
-			if(miss_mask.shape[1] > 0):
-				# If the miss_mask exists count the fill in miss_counts and slice out 
-				#  any missing values
-				mm_j = miss_mask[:,j]
-				for i,tr in enumerate(mm_j):
-					if(tr): miss_counts[y[i]] += 1
-				non_miss_j = ~mm_j
-
-				# Select all non missing features and labels for candidate split j 
-				xc_j = xc[non_miss_j,j]
-				y_j = y[non_miss_j]
+		# Otherwise we need to find the best threshold to split on per feature. Each feature
+		#  only writes to its own rows of the outputs so this can run in parallel.
+		for j in prange(n_c):
+			if(hist is not None and hist.shape[0] > 0):
+				# Histogram case, scan the bins instead of the samples
+				best_impurity, thresh, best_counts, best_op, miss_counts = \
+					cont_split_hist(hist[j], bin_edges[j], counts, base_impurity,
+						criterion_enum, total_enum, pos_ind, n_classes, sep_nan)
+				impurities[n_b+j,:2] = best_impurity
+				thresholds[j] = thresh
+				countsPS[n_b+j,:2] = best_counts
+				ops[n_b+j] = best_op
+				countsPS[n_b+j, 0] = countsPS[n_b+j, 0] + miss_counts 
 			else:
-				xc_j = xc[:,j]
-				y_j = y
-			
-			
-			# Sort by feature
-			srt_inds = np.argsort(xc_j)
-			xc_j = xc_j[srt_inds]
-			y_j = y_j[srt_inds]			
-
-			# print("xc_j",xc_j)
-			# print("y_j",y_j)
-
-			# NaN's end up at the end of a sort (in numpy), find where they start 
-			nan_start = len(xc_j)
-			for i in range(len(xc_j)-1,-1,-1):
-				if(not np.isnan(xc_j[i])): break
-				nan_start = i
-
-			#Find counts for NaN only bin
-			has_nan = nan_start != len(xc_j)
-			nan_counts = np.zeros((n_classes,),dtype=np.uint32)
-			for i in range(nan_start,len(xc_j)):
-				nan_counts[y_j[i]] += 1
-
-			# print("nan_start",nan_start)
-			
-			# Find left(0) and right(1) cumulative counts for splitting at each possible threshold
-			#  i.e figure out what child counts looks like if we put the threshold inbetween
-			#  each of the sorted feature pairs.			
-			cum_counts = np.zeros((nan_start+1, 2, n_classes),dtype=np.uint32)
-			for i in range(nan_start):
-				y_ij = y_j[i]
-				cum_counts[i+1, 0] = cum_counts[i, 0]
-				cum_counts[i+1, 0, y_ij] += 1
-
-			cum_counts[:,1] = (counts-(miss_counts+nan_counts)) - cum_counts[:,0]
-
-			# print("cum_counts", cum_counts)
-			
-			#Find all 'i' s.t. xc_j[i] != xc_j[i-1] (i.e. candidate pairs for threshold)
-			thresh_inds, c = np.empty((nan_start,),dtype=np.uint32), 0
-			for i in range(1, nan_start):
-				if(xc_j[i] != xc_j[i-1]):
-					thresh_inds[c] = i
-					c += 1
-					
-			# If every value is the same then just use i=0
-			best_impurity = np.zeros((2,),dtype=np.float64)
-			best_impurity[0] = base_impurity
-			best_impurity[1] = 1.0#np.inf
-			best_total_impurity, best_counts, best_op = np.inf, cum_counts[-1], OP_GE
-
-			
-			if(c > 0):
-				# If the features are not all the same find the best threshold
-				thresh_inds = thresh_inds[:c]
-				split_counts = best_ind = -1
-				for t_i in thresh_inds:
-					# We need to find the best of three choices for handling NaNs 
-					#  NOTE: can't just use >= since for all t (NaN >= t) == 0 
-				 	#  1 : (Nan|N vs Y) : x >= thresh
-					#  2 : (Nan|Y vs N) : x < thresh 
-					#  3 : (Y|N vs Nan) : np.isnan(x)
-
-					# Check (1 and 2) on every possible threshold
-					#  to see what leads to the smallest impurity
-					if(sep_nan and has_nan):
-						# Build counts for '<' and '>=", always putting NaNs in left
-						c_lt = np.empty((2, n_classes),dtype=np.uint32)
-						c_lt[0] = cum_counts[t_i,1] + nan_counts
-						c_lt[1] = cum_counts[t_i,0]
-						c_ge = np.empty((2, n_classes),dtype=np.uint32)
-						c_ge[0] = cum_counts[t_i,0] + nan_counts
-						c_ge[1] = cum_counts[t_i,1]
-
-						# Figure out which operation is better in terms of total impurity
-						impurity_lt = criterion_func(criterion_enum, c_lt, pos_ind, n_classes)
-						impurity_ge = criterion_func(criterion_enum, c_ge, pos_ind, n_classes)
-						total_impurity_lt = total_func(total_enum, impurity_lt) 
-						total_impurity_ge = total_func(total_enum, impurity_ge) 
-						if(total_impurity_lt < total_impurity_ge):
-							impurity = impurity_lt
-							total_impurity = total_impurity_lt
-							op = OP_LT 
-							split_counts = c_lt
+				# Generate and indicies along i that excludes missing values
+				miss_counts = np.zeros((n_classes,),dtype=np.uint32)
+
+				if(srt_inds is not None and srt_inds.shape[0] > 0):
+					# Walk the presorted ordering of feature j, setting aside any missing values
+					srt_j = srt_inds[j]
+					xc_j = np.empty((len(srt_j),),dtype=np.float64)
+					y_j = np.empty((len(srt_j),),dtype=y.dtype)
+					k = 0
+					for i in srt_j:
+						if(miss_mask.shape[1] > 0 and miss_mask[i,j]):
+							miss_counts[y[i]] += 1
 						else:
-							impurity = impurity_ge
-							total_impurity = total_impurity_ge
-							op = OP_GE 
-							split_counts = c_ge
-					else:
-						# When there are no NaNs or if we ignore them fallback on ">="
-						split_counts = cum_counts[t_i]
-						impurity = criterion_func(criterion_enum, split_counts, pos_ind, n_classes)
-						total_impurity = total_func(total_enum, impurity)
-						op = OP_GE
-					
-					if(total_impurity < best_total_impurity):
-						# If this is the best theshold point so far mark it as such
-						best_impurity, best_total_impurity = impurity, total_impurity
-						best_ind, best_op = t_i, op
-						best_counts = split_counts
-
-				thresh = (xc_j[best_ind-1] + xc_j[best_ind]) / 2.0 #if best_ind != 0 else np.inf
-			else:
-				# Otherwise just use a placeholder threshold
-				best_op = OP_GE
-				thresh = np.inf
-			
-			#See if using np.is_nan() would produce better results
-			if(sep_nan and has_nan):
-				#Left is non_NaN right is NaN
-				is_nan_counts = np.empty((2, n_classes),dtype=np.uint32)
-				is_nan_counts[0] = counts-(nan_counts+miss_counts)
-				is_nan_counts[1] = nan_counts
-
-				is_nan_impurity = criterion_func(criterion_enum, is_nan_counts,pos_ind, n_classes)
-				is_nan_total_impurity = total_func(total_enum, is_nan_impurity)
-				if(is_nan_total_impurity < best_total_impurity):
-					best_impurity, best_total_impurity = is_nan_impurity, is_nan_total_impurity
-					best_op = OP_ISNAN
-					best_counts = is_nan_counts
-
-			#Fill in outputs for candidate split j
-			impurities[n_b+j,:2] = best_impurity
-			thresholds[j] = thresh
-			countsPS[n_b+j,:2] = best_counts#
-			ops[n_b+j] = best_op
+							xc_j[k] = xc[i,j]
+							y_j[k] = y[i]
+							k += 1
+					xc_j, y_j = xc_j[:k], y_j[:k]
+				else:
+					# Select all non missing features and labels for candidate split j,
+					#  and count the labels of the missing ones in miss_counts 
+					xc_j = np.empty((len(inds),),dtype=np.float64)
+					y_j = np.empty((len(inds),),dtype=y.dtype)
+					k = 0
+					for i in inds:
+						if(miss_mask.shape[1] > 0 and miss_mask[i,j]):
+							miss_counts[y[i]] += 1
+						else:
+							xc_j[k] = xc[i,j]
+							y_j[k] = y[i]
+							k += 1
+					xc_j, y_j = xc_j[:k], y_j[:k]
+				
+					# Sort by feature
+					srt_inds_j = np.argsort(xc_j)
+					xc_j = xc_j[srt_inds_j]
+					y_j = y_j[srt_inds_j]			
+
+				best_impurity, thresh, best_counts, best_op = \
+					cont_split_sorted(xc_j, y_j, counts, miss_counts, base_impurity,
+						criterion_enum, total_enum, pos_ind, n_classes, sep_nan)
+
+				#Fill in outputs for candidate split j
+				impurities[n_b+j,:2] = best_impurity
+				thresholds[j] = thresh
+				countsPS[n_b+j,:2] = best_counts#
+				ops[n_b+j] = best_op
 			
-			# Even though missing values are ignored in impurity calculations 
-			#   the total counts still need to be correct. Throw them in left bin.
-			countsPS[n_b+j, 0] = countsPS[n_b+j, 0] + miss_counts 
+				# Even though missing values are ignored in impurity calculations 
+				#   the total counts still need to be correct. Throw them in left bin.
+				countsPS[n_b+j, 0] = countsPS[n_b+j, 0] + miss_counts 
 
-			
-	# print(countsPS)
-	# print("impurities")
-	# print(impurities)
-	# print("thresholds",thresholds)
-	# print("ops",ops)
 	return countsPS, impurities, thresholds, ops
 
 
@@ -702,9 +1147,9 @@ def get_counts_impurities(xb, xc, y, miss_mask, base_impurity, counts, criterion
 @njit(cache=True)
 def inf_gain(x_bin, x_cont, y, miss_mask, ft_weights, criterion_enum, total_enum, positive_class=1):
 	sorted_inds = np.argsort(y)
-	x_bin_sorted = x_bin[sorted_inds]
-	x_cont_sorted = x_cont[sorted_inds]
-	counts, u_ys, y_inds = unique_counts(y[sorted_inds]);
+	counts, u_ys, y_inds_sorted = unique_counts(y[sorted_inds]);
+	y_inds = np.empty((len(y),),dtype=np.uint32)
+	y_inds[sorted_inds] = y_inds_sorted
 
 	#Find the y_ind value associated with the positive class
 	pos_ind = 0
@@ -714,11 +1159,8 @@ def inf_gain(x_bin, x_cont, y, miss_mask, ft_weights, criterion_enum, total_enum
 	n_classes = len(u_ys)
 	impurity = criterion_func(criterion_enum, np.expand_dims(counts,0), pos_ind, n_classes)[0]
 
-	c_xb, c_xc, c_y = x_bin_sorted, x_cont_sorted, y_inds
-	c_mm = miss_mask 
-
 	countsPS, impurities, thresholds, ops =  \
-	get_counts_impurities(c_xb, c_xc, c_y, c_mm, impurity, counts,
+	get_counts_impurities(x_bin, x_cont, y_inds, miss_mask, impurity, counts,
 							criterion_enum, total_enum, pos_ind, n_classes, True)
 	# print("BI:", c.impurity)
 	# print("IMP:", impurities)
@@ -732,16 +1174,217 @@ def inf_gain(x_bin, x_cont, y, miss_mask, ft_weights, criterion_enum, total_enum
 
 
 
+#NOTE: No fastmath here (or in predict_tree) since it folds np.isnan() in exec_op to False
+# The number of contexts whose splits are searched for at once in fit_tree
+CONTEXTS_PER_BLOCK = 1
+
+######### Split Memo #########
+
+# With split_choice='all_max' the same samples can end up in several branches of the tree 
+#  (e.g. by splitting on A then B or on B then A). A SplitMemo keeps the outputs of 
+#  get_counts_impurities for the last 'memo_size' distinct sets of samples that were evaluated,
+#  keyed by their fingerprints, so that the others can be copied instead of recomputed. 
+#  The least recently used entry is evicted when it is full. 'prev' and 'next' link the 
+#  entries from most (head) to least (tail) recently used.
+split_memo_fields = [
+	('slots', FingerprintDictType),
+	('fp_lo', u8[::1]),
+	('fp_hi', u8[::1]),
+	('prev', i8[::1]),
+	('next', i8[::1]),
+	('head', i8),
+	('tail', i8),
+	('n_used', i8),
+	('countsPS', u4[:,:,:,::1]),
+	('impurities', f8[:,:,::1]),
+	('thresholds', f8[:,::1]),
+	('ops', u1[:,::1]),
+	('hits', i8),
+	('misses', i8),
+]
+
+SplitMemo, SplitMemoType = define_structref("SplitMemo", split_memo_fields)
+
+@njit(cache=True)
+def new_split_memo(memo_size, n_b, n_c, n_classes):
+	'''Makes an empty SplitMemo with room for the outputs of get_counts_impurities for
+		'memo_size' sets of samples.'''
+	capacity = 16
+	while(capacity < 2*memo_size): capacity *= 2
+	return SplitMemo(new_fpd(capacity), 
+		np.zeros((memo_size,),dtype=np.uint64), np.zeros((memo_size,),dtype=np.uint64),
+		np.full((memo_size,),-1,dtype=np.int64), np.full((memo_size,),-1,dtype=np.int64), -1, -1, 0,
+		np.empty((memo_size, n_b+n_c, 2, n_classes),dtype=np.uint32),
+		np.empty((memo_size, n_b+n_c, 2),dtype=np.float64),
+		np.empty((memo_size, n_c),dtype=np.float64),
+		np.empty((memo_size, n_b+n_c),dtype=np.uint8), 0, 0)
+
+@njit(cache=True)
+def _memo_unlink(memo, s):
+	p, n = memo.prev[s], memo.next[s]
+	if(p != -1): memo.next[p] = n
+	else: memo.head = n
+	if(n != -1): memo.prev[n] = p
+	else: memo.tail = p
+
+@njit(cache=True)
+def _memo_push_front(memo, s):
+	memo.prev[s], memo.next[s] = -1, memo.head
+	if(memo.head != -1): memo.prev[memo.head] = s
+	memo.head = s
+	if(memo.tail == -1): memo.tail = s
+
+@njit(cache=True)
+def memo_get(memo, fp_lo, fp_hi):
+	'''Returns the entry of the samples with fingerprint (fp_lo, fp_hi) and marks it as 
+		the most recently used, or -1 if they aren't in the memo.'''
+	s = fpd_get(memo.slots, fp_lo, fp_hi)
+	if(s == -1):
+		memo.misses += 1
+		return -1
+	memo.hits += 1
+	if(s != memo.head):
+		_memo_unlink(memo, s)
+		_memo_push_front(memo, s)
+	return i8(s)
+
+@njit(cache=True)
+def memo_put(memo, fp_lo, fp_hi):
+	'''Returns the entry that the outputs for the samples with fingerprint (fp_lo, fp_hi) 
+		should be written into, evicting the least recently used one if the memo is full.'''
+	s = fpd_get(memo.slots, fp_lo, fp_hi)
+	if(s != -1):
+		if(s != memo.head):
+			_memo_unlink(memo, s)
+			_memo_push_front(memo, s)
+		return i8(s)
+	if(memo.n_used < len(memo.fp_lo)):
+		s = memo.n_used
+		memo.n_used += 1
+	else:
+		s = memo.tail
+		_memo_unlink(memo, s)
+		fpd_remove(memo.slots, memo.fp_lo[s], memo.fp_hi[s])
+	memo.fp_lo[s], memo.fp_hi[s] = fp_lo, fp_hi
+	fpd_insert(memo.slots, fp_lo, fp_hi, i4(s))
+	_memo_push_front(memo, s)
+	return i8(s)
+
+
+@njit(cache=True)
+def evaluate_contexts(contexts, lo, hi, x_bin, x_cont, y_inds, miss_mask, sample_inds, srt_inds, bin_edges, criterion_enum, total_enum, pos_ind, n_classes, sep_nan, memo):
+	'''Finds the child counts and impurities of the best split on every feature for 
+		each of contexts[lo:hi]. Contexts own disjoint spans of sample_inds, so they are 
+		independent and can be evaluated in parallel. Contexts whose samples are in the 
+		SplitMemo 'memo' (if it has any room) are copied from it instead.'''
+	n_b, n_c = x_bin.shape[1], x_cont.shape[1]
+	countsPS_b = np.empty((hi-lo, n_b+n_c, 2, n_classes),dtype=np.uint32)
+	impurities_b = np.empty((hi-lo, n_b+n_c, 2),dtype=np.float64)
+	thresholds_b = np.empty((hi-lo, n_c),dtype=np.float64)
+	ops_b = np.empty((hi-lo, n_b+n_c),dtype=np.uint8)
+
+	# The memo is only touched outside of the prange so that its order doesn't depend on 
+	#  the threads
+	use_memo = len(memo.fp_lo) > 0
+	entries = np.full((hi-lo,),-1,dtype=np.int64)
+	if(use_memo):
+		for k in range(hi-lo):
+			c = contexts[lo+k]
+			entries[k] = memo_get(memo, c.fp_lo, c.fp_hi)
+	memo_countsPS, memo_impurities, memo_thresholds, memo_ops = \
+		memo.countsPS, memo.impurities, memo.thresholds, memo.ops
+
+	for k in prange(hi-lo):
+		s = entries[k]
+		if(s != -1):
+			countsPS_b[k] = memo_countsPS[s]
+			impurities_b[k] = memo_impurities[s]
+			thresholds_b[k] = memo_thresholds[s]
+			ops_b[k] = memo_ops[s]
+		else:
+			c = contexts[lo+k]
+			countsPS, impurities, thresholds, ops =  \
+				get_counts_impurities(x_bin, x_cont, y_inds, miss_mask, c.impurity, c.counts,
+										criterion_enum, total_enum, pos_ind, n_classes, sep_nan, 
+										sample_inds[c.start:c.end], srt_inds[:,c.start:c.end], c.hist, bin_edges)
+			countsPS_b[k] = countsPS
+			impurities_b[k] = impurities
+			thresholds_b[k] = thresholds
+			ops_b[k] = ops
+
+	if(use_memo):
+		for k in range(hi-lo):
+			if(entries[k] != -1): continue
+			c = contexts[lo+k]
+			s = memo_put(memo, c.fp_lo, c.fp_hi)
+			memo.countsPS[s] = countsPS_b[k]
+			memo.impurities[s] = impurities_b[k]
+			memo.thresholds[s] = thresholds_b[k]
+			memo.ops[s] = ops_b[k]
+	return countsPS_b, impurities_b, thresholds_b, ops_b
+
+@njit(cache=True)
+def mask_small_splits(impurity_decrease, countsPS, min_samples_leaf):
+	'''Caps the impurity decrease of each split that would leave fewer than min_samples_leaf 
+		samples on either side at 0, so that it is never made.'''
+	if(min_samples_leaf <= 1): return
+	for k in range(len(impurity_decrease)):
+		if(countsPS[k,0].sum() < min_samples_leaf or countsPS[k,1].sum() < min_samples_leaf):
+			impurity_decrease[k] = min(impurity_decrease[k], 0.0)
+
+@njit(cache=True)
+def impurity_decreases(impurity, impurities, countsPS, total_enum, ft_weights, min_samples_leaf=1):
+	'''The decrease in impurity from 'impurity' of the split on each feature, weighted by 
+		ft_weights if it isn't empty.'''
+	#Sum of new impurities of left and right side of split
+	total_split_impurity = total_func_multiple(total_enum, impurities)
+	impurity_decrease = impurity - total_split_impurity
+	if(len(ft_weights) > 0): impurity_decrease = impurity_decrease * ft_weights
+	mask_small_splits(impurity_decrease, countsPS, min_samples_leaf)
+	return impurity_decrease
+
+@njit(nogil=True,cache=True)
+def fill_go_right(go_right, x_bin, x_cont, miss_mask, inds, split, op, thresh):
+	'''Marks go_right[i] for each sample i in 'inds' that goes right when splitting 
+		on feature 'split'. Missing values always go left.'''
+	n_b = x_bin.shape[1]
+	if(split < n_b):
+		for i in inds:
+			go_right[i] = binary_value(x_bin,i,split) == 1
+	else:
+		j = split-n_b
+		has_miss = miss_mask.shape[1] > 0
+		for i in inds:
+			if(has_miss and miss_mask[i,j]):
+				go_right[i] = 0
+			else:
+				go_right[i] = exec_op(op, x_cont[i,j], thresh)
+
+
 @njit(cache=True, locals={"ZERO":i4,"NODE":i4,"LEAF":i4,"n_nodes":i4,"node_l":i4,"node_r":i4,"node_n":i4,"split":i4})
-def fit_tree(x_bin, x_cont, y, miss_mask, ft_weights, criterion_enum, total_enum, split_enum, criterion_enum2=0, total_enum2=0, positive_class=1, sep_nan=False, cache_nodes=False):
-	'''Fits a decision/ambiguity tree'''
+def fit_tree(x_bin, x_cont, y, miss_mask, ft_weights, criterion_enum, total_enum, split_enum, criterion_enum2=0, total_enum2=0, positive_class=1, sep_nan=False, cache_nodes=False, presort=False, max_bins=0, fingerprint_nodes=False, memo_size=0, max_splits_per_node=0, max_nodes=0, best_first=False, max_depth=0, min_samples_split=2, min_samples_leaf=1, min_impurity_decrease=0.0):
+	'''Fits a decision/ambiguity tree. If 'presort' is True each continous feature 
+		is argsorted once up front instead of at every node. If 'max_bins' is nonzero 
+		each continous feature is quantized into at most max_bins bins up front and 
+		splits are found from per-node histograms. If 'fingerprint_nodes' is True then 
+		cache_nodes identifies nodes by a 128-bit fingerprint of their samples instead 
+		of a copy of them. If 'memo_size' is nonzero then the split search of the last 
+		memo_size distinct sets of samples is memoized (see SplitMemo). If nonzero, at most 
+		'max_splits_per_node' splits are made on each node and at most 'max_nodes' nodes 
+		are made in total. If 'best_first' is True then the node with the largest impurity 
+		decrease is split next instead of splitting the tree one depth at a time. Like in 
+		sklearn nodes deeper than 'max_depth' (if nonzero) or with fewer than 
+		'min_samples_split' samples aren't split, splits must leave at least 
+		'min_samples_leaf' samples on each side, and decrease impurity by more than 
+		'min_impurity_decrease'.'''
 
 	#ENUMS definitions necessary if want to use 32bit integers since literals default to 64bit
 	ZERO, NODE, LEAF = 0, 1, 2
+	n_samples, n_b, n_c = len(y), x_bin.shape[1], x_cont.shape[1]
 	sorted_inds = np.argsort(y)
-	x_bin_sorted = x_bin[sorted_inds]
-	x_cont_sorted = x_cont[sorted_inds]
-	counts, u_ys, y_inds = unique_counts(y[sorted_inds]);
+	counts, u_ys, y_inds_sorted = unique_counts(y[sorted_inds]);
+	y_inds = np.empty((n_samples,),dtype=np.uint32)
+	y_inds[sorted_inds] = y_inds_sorted
 
 	#Find the y_ind value associated with the positive class
 	pos_ind = 0
@@ -751,49 +1394,116 @@ def fit_tree(x_bin, x_cont, y, miss_mask, ft_weights, criterion_enum, total_enum
 	n_classes = len(u_ys)
 	impurity = criterion_func(criterion_enum, np.expand_dims(counts,0), pos_ind, n_classes)[0]
 
+	# Like in sklearn the samples in each node are kept contiguous in one buffer 'sample_inds' 
+	#  which is partitioned in place, so each context only needs a 'start' and 'end'. 
+	#  When several splits are made on one node (i.e. all_max) every split but the last is 
+	#  partitioned into a new span at the end of the buffer. Partitions are stable so the 
+	#  samples in a span stay in the same order as in the root (which matters for cache_nodes).
+	sample_inds = sorted_inds.astype(np.uint32)
+	n_used = n_samples
+	go_right = np.zeros((n_samples,),dtype=np.uint8)
+	scratch = np.empty((n_samples,),dtype=np.uint32)
+
+	# Sort each continous feature once, the span [start,end) of srt_inds[j] holds the samples 
+	#  of a context ordered by feature j, and is partitioned alongside sample_inds
+	if(presort):
+		srt_inds = np.empty((n_c, n_samples), dtype=np.uint32)
+		for j in range(n_c):
+			srt_inds[j] = np.argsort(x_cont[:,j])
+	else:
+		srt_inds = np.empty((0,0), dtype=np.uint32)
+
+	# Quantize each continous feature once, each node then keeps a histogram per feature 
+	if(max_bins):
+		x_codes, bin_edges = bin_continuous(x_cont, max_bins)
+		hist = build_histogram(x_codes, y_inds, miss_mask, sample_inds, max_bins, n_classes)
+	else:
+		x_codes = np.empty((0,0), dtype=np.uint8)
+		bin_edges = np.empty((0,0), dtype=np.float64)
+		hist = np.empty((0,0,0), dtype=np.uint32)
+
+	# The fingerprints of each context's samples are only needed to memoize split search
+	memo = new_split_memo(memo_size, n_b, n_c, n_classes)
+	fp_lo, fp_hi = fingerprint(sample_inds) if memo_size > 0 else (u8(0), u8(0))
+
+	# A node needs at least this many samples to be split 
+	min_split = max(min_samples_split, 2*min_samples_leaf)
+
 	contexts = List.empty_list(SC)
-	contexts.append(SplitContext(np.arange(0,len(y),dtype=np.uint32),impurity,counts,ZERO))
+	root_ttype = NODE
+	if(n_samples >= min_split):
+		contexts.append(SplitContext(0,n_samples,impurity,counts,ZERO,hist,fp_lo,fp_hi,0))
+	else:
+		root_ttype = LEAF
 
-	node_dict = Dict.empty(u4,BE_List)
+	node_dict = new_akd()
+	fp_dict = new_fpd()
 	nodes = List.empty_list(TN)
-	nodes.append(TreeNode(NODE,ZERO,OP_NOP,List.empty_list(i4_arr),counts))
-	while len(contexts) > 0:
+	nodes.append(TreeNode(root_ttype,ZERO,OP_NOP,List.empty_list(i4_arr),counts))
+
+	# With best_first the contexts that haven't been split yet are kept in a heap ordered 
+	#  by the largest impurity decrease of their splits (ties go to the oldest context). 
+	#  Their split searches are kept in the 'frontier_*' dicts keyed by their order. 
+	frontier = [(0.0, 0)]; frontier.pop()
+	frontier_contexts = Dict.empty(i8, SC)
+	frontier_countsPS = Dict.empty(i8, u4[:,:,::1])
+	frontier_impurities = Dict.empty(i8, f8[:,::1])
+	frontier_thresholds = Dict.empty(i8, f8[::1])
+	frontier_ops = Dict.empty(i8, u1[::1])
+	n_pushed = 0
+
+	while len(contexts) > 0 or len(frontier) > 0:
+		if(best_first):
+			# Search the new contexts now so that they can be ordered by their best split, 
+			#  and then only split the best context on the frontier
+			for i in range(0, len(contexts), CONTEXTS_PER_BLOCK):
+				countsPS_b, impurities_b, thresholds_b, ops_b = evaluate_contexts(
+					contexts, i, min(i+CONTEXTS_PER_BLOCK, len(contexts)), 
+					x_bin, x_cont, y_inds, miss_mask, sample_inds, srt_inds, bin_edges,
+					criterion_enum, total_enum, pos_ind, n_classes, sep_nan, memo)
+				for b in range(len(countsPS_b)):
+					c = contexts[i+b]
+					impurity_decrease = impurity_decreases(c.impurity, impurities_b[b], countsPS_b[b], 
+						total_enum, ft_weights, min_samples_leaf)
+					heapq.heappush(frontier, (-np.max(impurity_decrease), n_pushed))
+					frontier_contexts[n_pushed] = c
+					frontier_countsPS[n_pushed] = countsPS_b[b]
+					frontier_impurities[n_pushed] = impurities_b[b]
+					frontier_thresholds[n_pushed] = thresholds_b[b]
+					frontier_ops[n_pushed] = ops_b[b]
+					n_pushed += 1
+			if(len(frontier) == 0): break
+			_, e = heapq.heappop(frontier)
+			contexts = List.empty_list(SC)
+			contexts.append(frontier_contexts.pop(e))
+			countsPS, impurities = frontier_countsPS.pop(e), frontier_impurities.pop(e)
+			thresholds, ops = frontier_thresholds.pop(e), frontier_ops.pop(e)
+
 		new_contexts = List.empty_list(SC)
-		locs = (node_dict,nodes,new_contexts,cache_nodes)
+		locs = (node_dict,fp_dict,nodes,new_contexts,cache_nodes,fingerprint_nodes,max_depth,min_split)
 		for i in range(len(contexts)):
 			c = contexts[i]
-			# print("c_ind", c.inds)
-			c_xb, c_xc, c_y = x_bin_sorted[c.inds], x_cont_sorted[c.inds], y_inds[c.inds]
-			c_mm = miss_mask if(miss_mask.shape[1] == 0) else miss_mask[c.inds]
-
-			# c_xb, c_y = x_sorted[c.inds], y_inds[c.inds]
-			#Bad solution, 
-			# ms_v, k = np.empty((len(c.inds),2), dtype=np.int64), 0
-			# for miss_i, miss_j in missing_values:
-			# 	if(miss_i in c.inds):
-			# 		ms_v[k,0] = miss_i
-			# 		ms_v[k,1] = miss_j
-			# 		k += 1
-			# ms_v = ms_v[:k]
-			# missing = np.argwhere(missing_values[:,0] == split)[:,0]
-			# countsPS = counts_per_split(c_x, c_y, n_classes, missing_values, sep_nan)
-			# # print("M PS:", missing_values, "\n", countsPS)
-			# flat_impurities = criterion_func(criterion_enum,countsPS.reshape((-1,countsPS.shape[2])))
-			# impurities = flat_impurities.reshape((countsPS.shape[0],countsPS.shape[1]))
-			# def get_counts_impurities(xb, xc, y, miss_mask, base_impurity, counts, criterion_enum, total_enum, pos_ind, n_classes, sep_nan):
-			countsPS, impurities, thresholds, ops =  \
-				get_counts_impurities(c_xb, c_xc, c_y, c_mm, c.impurity, c.counts,
-										criterion_enum, total_enum, pos_ind, n_classes, sep_nan)
+			# Once there is no room for two more nodes the rest of the contexts become leaves 
+			if(max_nodes > 0 and len(nodes)+2 > max_nodes):
+				nodes[c.parent_node]=TreeNode(LEAF,c.parent_node,OP_NOP,List.empty_list(i4_arr),c.counts)
+				continue
+
+			# With best_first the split search of the context was already done
+			if(not best_first):
+				# The split search for a block of contexts is done before any of them are split
+				#  since it only reads from the spans of sample_inds that the contexts own.
+				b = i % CONTEXTS_PER_BLOCK
+				if(b == 0):
+					countsPS_b, impurities_b, thresholds_b, ops_b = evaluate_contexts(
+						contexts, i, min(i+CONTEXTS_PER_BLOCK, len(contexts)), 
+						x_bin, x_cont, y_inds, miss_mask, sample_inds, srt_inds, bin_edges,
+						criterion_enum, total_enum, pos_ind, n_classes, sep_nan, memo)
+				countsPS, impurities, thresholds, ops = countsPS_b[b], impurities_b[b], thresholds_b[b], ops_b[b]
+			inds = sample_inds[c.start:c.end]
 			# print("BI:", c.impurity)
 			# print("IMP:", impurities)
 			# print(countsPS, impurities, thresholds, ops)
-			#Sum of new impurities of left and right side of split
-			total_split_impurity = total_func_multiple(total_enum, impurities)
-			# if(sep_nan): total_split_impurity += impurities[:,2]
-			impurity_decrease = c.impurity - (total_split_impurity);
-			# print("impurity_decrease", impurity_decrease)
-			# print("ft_weights", ft_weights)
-			if(len(ft_weights) > 0): impurity_decrease = impurity_decrease * ft_weights
+			impurity_decrease = impurity_decreases(c.impurity, impurities, countsPS, total_enum, ft_weights, min_samples_leaf)
 			# print("impurity_decrease", impurity_decrease)
 			splits = split_chooser(split_enum, impurity_decrease)
 
@@ -808,8 +1518,11 @@ def fit_tree(x_bin, x_cont, y, miss_mask, ft_weights, criterion_enum, total_enum
 
 				total_split_impurity = total_func_multiple(total_enum2, sec_impurities)
 				impurity_decrease = sec_c_impurity - (total_split_impurity);
+				mask_small_splits(impurity_decrease, countsPS, min_samples_leaf)
 				splits = split_chooser(split_enum, impurity_decrease)
 				print("NEW SPLIT", splits, np.max(impurity_decrease))
+			if(max_splits_per_node > 0 and len(splits) > max_splits_per_node):
+				splits = splits[:max_splits_per_node]
 			# print("splits",splits)
 			# print("---------")
 			# print("ops", ops)
@@ -817,71 +1530,103 @@ def fit_tree(x_bin, x_cont, y, miss_mask, ft_weights, criterion_enum, total_enum
 			for j in range(len(splits)):
 				split = splits[j]
 
-				if(impurity_decrease[split] <= 0.0):
+				if(impurity_decrease[split] <= min_impurity_decrease):
 					nodes[c.parent_node]=TreeNode(LEAF,c.parent_node,OP_NOP,List.empty_list(i4_arr),c.counts)
+				elif(max_nodes > 0 and len(nodes)+2 > max_nodes):
+					# Out of nodes, keep the splits that were already made on this node
+					break
 				else:
-					if (split < c_xb.shape[1]):
-						op = OP_GE
-						split_miss_mask = c_xb[:,split] > 1
-						
-						# print("c_xb",c_xb)
-						mask = c_xb[:,split] == 1
-						# print("bmask", mask)
+					op = OP_GE if split < n_b else ops[split]
+					thresh_f = thresholds[split-n_b] if split >= n_b else np.inf
+					fill_go_right(go_right, x_bin, x_cont, miss_mask, inds, split, op, thresh_f)
+
+					# The last split on a node is partitioned in place, the others get new spans
+					start, end = c.start, c.end
+					if(j != len(splits)-1):
+						n_c_samples = c.end-c.start
+						sample_inds = ensure_capacity(sample_inds, n_used, n_used+n_c_samples)
+						sample_inds[n_used:n_used+n_c_samples] = sample_inds[c.start:c.end]
+						if(presort):
+							srt_inds = ensure_capacity(srt_inds, n_used, n_used+n_c_samples)
+							srt_inds[:,n_used:n_used+n_c_samples] = srt_inds[:,c.start:c.end]
+						start, end = n_used, n_used+n_c_samples
+						n_used += n_c_samples
+						inds = sample_inds[c.start:c.end]
+
+					# With cache_nodes the children's samples are hashed while partitioning
+					if((cache_nodes and fingerprint_nodes) or memo_size > 0):
+						n_l, key_l, key_r = partition_inplace_fingerprinted(sample_inds[start:end], go_right, scratch)
+					elif(cache_nodes):
+						n_l, h_l, h_r = partition_inplace_hashed(sample_inds[start:end], go_right, scratch)
+						key_l, key_r = (h_l, u8(0)), (h_r, u8(0))
+					else:
+						n_l = partition_inplace(sample_inds[start:end], go_right, scratch)
+						key_l, key_r = (u8(0), u8(0)), (u8(0), u8(0))
+					mid = start+n_l
+					if(presort):
+						for k in range(n_c):
+							partition_inplace(srt_inds[k,start:end], go_right, scratch)
+
+					new_hist_l, new_hist_r = child_histograms(x_codes, y_inds, miss_mask, c.hist,
+						sample_inds[start:mid], sample_inds[mid:end], n_classes)
 
-					else: 
-						
-						op = ops[split]
-						split_miss_mask = c_mm[:,split]
-
-						# print("c_xc",c_xc)
-						split_slice = c_xc[:,split-c_xb.shape[1]]
-						# print("split_slice",c_xc)
-						if(op == OP_GE):
-							mask = (split_slice >= thresholds[split-c_xb.shape[1]])#.astype(np.uint8)
-						elif(op == OP_LT):
-							mask = (split_slice < thresholds[split-c_xb.shape[1]])#.astype(np.uint8)
-						elif(op == OP_ISNAN):
-							mask = np.isnan(split_slice)#.astype(np.uint8)
-						# print("cmask", mask)
-						# print(op)
-
-						# n_mask = np.isnan(c_xc[:,split-c_xb.shape[1]]).astype(np.uint8)
-						
-						# mask = np.where(n_mask, u1(255), mask)
-						# mask[n_mask] = 255
-					# print("mask",mask)
-					# print("split_miss_mask",split_miss_mask)
-					# missing = np.argwhere(missing_values[:,1] == split)[:,0]
-					# print("missing", split, missing)
 					node_l, node_r = -1, -1
-					# print("mask", mask)
-					new_inds_l, new_inds_r = r_l_split(mask, split_miss_mask)
-					# print("new_inds",c.inds, new_inds_l, new_inds_r)
-					new_inds_l, new_inds_r = c.inds[new_inds_l], c.inds[new_inds_r]
-					# print("new_inds",c.inds, new_inds_l, new_inds_r)
-					# locs = (node_dict, nodes,new_contexts, cache_nodes)
 					#New node for left.
-					node_l = new_node(locs, split, OP_NOP, new_inds_l, impurities,countsPS, literally(0))
+					node_l = new_node(locs, split, OP_NOP, sample_inds, start, mid, new_hist_l, impurities,countsPS, literally(0), key_l, c.depth+1)
 
 					#New node for right.
-					node_r = new_node(locs, split, OP_NOP, new_inds_r, impurities,countsPS, literally(1))
+					node_r = new_node(locs, split, OP_NOP, sample_inds, mid, end, new_hist_r, impurities,countsPS, literally(1), key_r, c.depth+1)
 
 					# #New node for NaN values.
 					# if(sep_nan and len(new_inds_n) > 0):
 					# 	node_n = new_node(locs,split,new_inds_n, impurities,countsPS,literally(2))
 					
 					#If is continous bitcast threshold to an i4 else set to 1 i.e. 1e-45
-					thresh = np.float32(thresholds[split-c_xb.shape[1]]).view(np.int32) if split >= c_xb.shape[1] else 1
+					thresh = np.float32(thresholds[split-n_b]).view(np.int32) if split >= n_b else 1
 					split_data = np.array([split, thresh, node_l, node_r, -1],dtype=np.int32)
 					nodes[c.parent_node].split_data.append(split_data)
 					nodes[c.parent_node].op_enum = op
 
 		contexts = new_contexts
 
-	out = Tree(nodes,u_ys)
+	out = Tree(nodes,u_ys,memo.hits,memo.misses)
 	# out = encode_tree(nodes,u_ys)
 	return out
 
+######### Parallel Variants #########
+
+PARALLEL_none = 0
+PARALLEL_features = 1
+PARALLEL_nodes = 2
+
+# The split search over features is compiled a second time with parallel=True so that the
+#  prange loops in counts_impurities_per_binary_split and get_counts_impurities run on multiple threads.
+#  Each feature is evaluated independently and the split is chosen afterwards in the same order, 
+#  so the resulting trees are identical to the serial ones. The serial versions are left 
+#  untouched so that the default path never spins up the threading layer.
+counts_impurities_per_binary_split_parallel = compile_variant(counts_impurities_per_binary_split, "parallel",
+	parallel=True, cache=True)
+get_counts_impurities_parallel = compile_variant(get_counts_impurities, "parallel",
+	{'counts_impurities_per_binary_split' : counts_impurities_per_binary_split_parallel}, parallel=True, cache=True)
+evaluate_contexts_parallel_features = compile_variant(evaluate_contexts, "parallel_features",
+	{'get_counts_impurities' : get_counts_impurities_parallel}, cache=True)
+fit_tree_parallel_features = compile_variant(fit_tree, "parallel_features",
+	{'evaluate_contexts' : evaluate_contexts_parallel_features}, cache=True)
+
+# Deep levels of a tree have many small nodes where there is too little work per feature
+#  for the above to pay off. Instead the contexts of each level are evaluated in parallel 
+#  in blocks, and then split one by one in their original order, so the nodes are created 
+#  in the same order as the serial version.
+evaluate_contexts_parallel = compile_variant(evaluate_contexts, "parallel",
+	parallel=True, cache=True)
+fit_tree_parallel_nodes = compile_variant(fit_tree, "parallel_nodes",
+	{'evaluate_contexts' : evaluate_contexts_parallel, 'CONTEXTS_PER_BLOCK' : 256}, cache=True)
+
+def resolve_n_jobs(n_jobs):
+	'''Returns the number of threads to use for 'n_jobs', where -1 means all of them.'''
+	if(n_jobs == -1): return numba.config.NUMBA_NUM_THREADS
+	return min(n_jobs, numba.config.NUMBA_NUM_THREADS)
+
 split_dtype = np.dtype([('split', np.int32), ('thresh', np.float32), ('node_l', np.int32), ('node_r', np.int32), ('node_n', np.int32)])
 
 @njit(nogil=True,fastmath=True)
@@ -1174,7 +1919,7 @@ def exec_op(op, val, thresh):
 
 
 		
-@njit(nogil=True,fastmath=True, cache=True, locals={"ZERO":u1, "VISIT":u1, "VISITED": u1, "_n":i4})
+@njit(nogil=True, cache=True, locals={"ZERO":u1, "VISIT":u1, "VISITED": u1, "_n":i4})
 def predict_tree(tree,xb,xc,pred_choice_enum,positive_class=0,decode_classes=True):
 	'''Predicts the class associated with an unlabelled sample using a fitted 
 		decision/ambiguity tree'''
@@ -1240,6 +1985,216 @@ def predict_tree(tree,xb,xc,pred_choice_enum,positive_class=0,decode_classes=Tru
 	return out
 
 
+@njit(nogil=True, cache=True)
+def freeze_tree(tree):
+	'''Copies a fitted Tree into a FrozenTree'''
+	nodes = tree.nodes
+	n_nodes, n_classes = len(nodes), len(tree.u_ys)
+	ttype = np.empty((n_nodes,),dtype=np.uint8)
+	op = np.empty((n_nodes,),dtype=np.uint8)
+	split_starts = np.empty((n_nodes+1,),dtype=np.int32)
+	leaf_value = np.full((n_nodes,),-1,dtype=np.int32)
+	counts = np.empty((n_nodes, n_classes),dtype=np.uint32)
+
+	split_starts[0] = 0
+	for i, node in enumerate(nodes):
+		split_starts[i+1] = split_starts[i] + len(node.split_data)
+
+	n_splits = split_starts[n_nodes]
+	feature = np.empty((n_splits,),dtype=np.int32)
+	ithreshold = np.empty((n_splits,),dtype=np.int32)
+	left = np.empty((n_splits,),dtype=np.int32)
+	right = np.empty((n_splits,),dtype=np.int32)
+	for i, node in enumerate(nodes):
+		ttype[i] = node.ttype
+		op[i] = node.op_enum
+		counts[i] = node.counts
+		if(node.ttype == TreeTypes_LEAF): leaf_value[i] = np.argmax(node.counts)
+		for k, s in enumerate(node.split_data):
+			s_i = split_starts[i]+k
+			feature[s_i], ithreshold[s_i], left[s_i], right[s_i] = s[0], s[1], s[2], s[3]
+
+	return FrozenTree(ttype, op, split_starts, feature, ithreshold.view(np.float32),
+					  left, right, leaf_value, counts, tree.u_ys)
+
+@njit(nogil=True, cache=True)
+def predict_frozen_tree(tree,xb,xc,pred_choice_enum,positive_class=0,decode_classes=True):
+	'''Same as predict_tree but for a FrozenTree'''
+	L = max(xb.shape[0],len(xc))
+	out = np.empty((L,),dtype=np.int64)
+	n_nodes = len(tree.ttype)
+
+	# Nodes left to visit and the nodes visited so far. The visited flags are reset after 
+	#  each sample by going back through 'visited' instead of clearing the whole mask.
+	to_visit = np.empty((n_nodes,),dtype=np.int32)
+	visited = np.empty((n_nodes,),dtype=np.int32)
+	visited_mask = np.zeros((n_nodes,),dtype=np.uint8)
+	for i in range(L):
+		leafs = List.empty_list(u4_arr)
+		to_visit[0], visited[0], visited_mask[0] = 0, 0, 1
+		n_to_visit, n_visited = 1, 1
+		while n_to_visit > 0:
+			n_to_visit -= 1
+			ind = to_visit[n_to_visit]
+			if(tree.ttype[ind] == TreeTypes_NODE):
+				op = tree.op[ind]
+				# Test every split in the node. In a traditional decision tree there 
+				#  should only be one split per node.
+				for s in range(tree.split_starts[ind], tree.split_starts[ind+1]):
+					j = tree.feature[s]
+					if(j < xb.shape[1]):
+						# Binary case
+						_n = tree.right[s] if binary_value(xb,i,j) else tree.left[s]
+					else:
+						# Continous case
+						if(exec_op(op,xc[i,j-xb.shape[1]],tree.threshold[s])):
+							_n = tree.right[s]
+						else:
+							_n = tree.left[s]
+					if(not visited_mask[_n]):
+						visited_mask[_n] = 1
+						visited[n_visited] = _n
+						to_visit[n_to_visit] = _n
+						n_visited += 1; n_to_visit += 1
+			else:
+				leafs.append(tree.counts[ind])
+
+		for k in range(n_visited):
+			visited_mask[visited[k]] = 0
+
+		out_i = pred_choice_func(pred_choice_enum, leafs, positive_class)
+		if(decode_classes):out_i = tree.u_ys[out_i]
+		out[i] = out_i
+	return out
+
+
+@njit(nogil=True, cache=True, inline='never')
+def leaf_choice(pred_choice_enum, leaf_value, positive_class):
+	'''Equivalent to pred_choice_func for a sample that ends up in just one leaf.'''
+	if(pred_choice_enum == PRED_CHOICE_majority_general or 
+	   pred_choice_enum == PRED_CHOICE_pure_majority_general):
+		return 1 if leaf_value == positive_class else 0
+	return leaf_value
+
+@njit(nogil=True, cache=True)
+def predict_frozen_tree_single(tree,xb,xc,out,pred_choice_enum,positive_class=0,decode_classes=True):
+	'''Predicts into 'out' by following the one path from the root to a leaf for
+		each sample. Only valid for trees with at most one split per node, which is 
+		the case for split_choice='single_max'. Nothing is allocated per sample.'''
+	n_b = xb.shape[1]
+	for i in prange(len(out)):
+		ind = 0
+		while tree.ttype[ind] == TreeTypes_NODE:
+			s = tree.split_starts[ind]
+			j = tree.feature[s]
+			if(j < n_b):
+				# Binary case
+				go_right = binary_value(xb,i,j) != 0
+			else:
+				# Continous case
+				go_right = exec_op(tree.op[ind],xc[i,j-n_b],tree.threshold[s])
+			ind = tree.right[s] if go_right else tree.left[s]
+
+		out_i = leaf_choice(pred_choice_enum, tree.leaf_value[ind], positive_class)
+		if(decode_classes):out_i = tree.u_ys[out_i]
+		out[i] = out_i
+	return out
+
+@njit(nogil=True, cache=True)
+def predict_frozen_tree_into(tree,xb,xc,out,pred_choice_enum,positive_class=0,decode_classes=True):
+	'''Same as predict_frozen_tree but writes the predictions into 'out' '''
+	out[:] = predict_frozen_tree(tree,xb,xc,pred_choice_enum,positive_class,decode_classes)
+	return out
+
+@njit(nogil=True, cache=True, parallel=True)
+def predict_frozen_tree_blocks(tree,xb,xc,out,pred_choice_enum,positive_class=0,decode_classes=True):
+	'''Predicts into 'out' by splitting the rows into one block per thread, each of 
+		which is predicted with predict_frozen_tree.'''
+	L, n_blocks = len(out), numba.get_num_threads()
+	for b in prange(n_blocks):
+		lo, hi = (b*L)//n_blocks, ((b+1)*L)//n_blocks
+		# Slicing a (0,0) placeholder for a missing xb or xc leaves it unchanged
+		out[lo:hi] = predict_frozen_tree(tree,row_slice(xb,lo,hi),xc[lo:hi],pred_choice_enum,
+										 positive_class,decode_classes)
+	return out
+
+# Rows are independent so the single path predict just needs its prange enabled
+predict_frozen_tree_single_parallel = compile_variant(predict_frozen_tree_single, "parallel",
+	parallel=True, cache=True)
+
+######### Binary Format Variants #########
+
+def compile_binary_format_variants(suffix, counts_per_binary_split_f, binary_value_f, row_slice_f,
+								   counts_per_binary_split_parallel_f=None):
+	'''Compiles every fit_tree and predict function again for a format of xb other than a
+		dense array. Returns the fit_tree variant for each parallel mode, and the predict 
+		variants in the same order as PREDICT_VARIANTS['dense'].'''
+	if(counts_per_binary_split_parallel_f is None):
+		counts_per_binary_split_parallel_f = counts_per_binary_split_f
+	counts_impurities_f = compile_variant(counts_then_impurities_per_binary_split, suffix,
+		{'counts_per_binary_split' : counts_per_binary_split_f}, cache=True)
+	get_counts_impurities_f = compile_variant(get_counts_impurities, suffix,
+		{'counts_impurities_per_binary_split' : counts_impurities_f}, cache=True)
+	evaluate_contexts_f = compile_variant(evaluate_contexts, suffix,
+		{'get_counts_impurities' : get_counts_impurities_f}, cache=True)
+	fill_go_right_f = compile_variant(fill_go_right, suffix,
+		{'binary_value' : binary_value_f}, cache=True)
+	fit_tree_f = compile_variant(fit_tree, suffix,
+		{'evaluate_contexts' : evaluate_contexts_f, 'fill_go_right' : fill_go_right_f}, cache=True)
+
+	counts_impurities_parallel_f = compile_variant(counts_then_impurities_per_binary_split, suffix+"_parallel",
+		{'counts_per_binary_split' : counts_per_binary_split_parallel_f}, cache=True)
+	get_counts_impurities_parallel_f = compile_variant(get_counts_impurities, suffix+"_parallel",
+		{'counts_impurities_per_binary_split' : counts_impurities_parallel_f}, parallel=True, cache=True)
+	evaluate_contexts_parallel_features_f = compile_variant(evaluate_contexts, suffix+"_parallel_features",
+		{'get_counts_impurities' : get_counts_impurities_parallel_f}, cache=True)
+	fit_tree_parallel_features_f = compile_variant(fit_tree, suffix+"_parallel_features",
+		{'evaluate_contexts' : evaluate_contexts_parallel_features_f, 'fill_go_right' : fill_go_right_f}, cache=True)
+
+	evaluate_contexts_parallel_f = compile_variant(evaluate_contexts, suffix+"_parallel",
+		{'get_counts_impurities' : get_counts_impurities_f}, parallel=True, cache=True)
+	fit_tree_parallel_nodes_f = compile_variant(fit_tree, suffix+"_parallel_nodes",
+		{'evaluate_contexts' : evaluate_contexts_parallel_f, 'fill_go_right' : fill_go_right_f,
+		 'CONTEXTS_PER_BLOCK' : 256}, cache=True)
+
+	predict_frozen_tree_f = compile_variant(predict_frozen_tree, suffix,
+		{'binary_value' : binary_value_f}, cache=True)
+	predict_frozen_tree_single_f = compile_variant(predict_frozen_tree_single, suffix,
+		{'binary_value' : binary_value_f}, cache=True)
+	predict_frozen_tree_single_parallel_f = compile_variant(predict_frozen_tree_single, suffix+"_parallel",
+		{'binary_value' : binary_value_f}, parallel=True, cache=True)
+	predict_frozen_tree_into_f = compile_variant(predict_frozen_tree_into, suffix,
+		{'predict_frozen_tree' : predict_frozen_tree_f}, cache=True)
+	predict_frozen_tree_blocks_f = compile_variant(predict_frozen_tree_blocks, suffix,
+		{'predict_frozen_tree' : predict_frozen_tree_f, 'row_slice' : row_slice_f}, cache=True)
+
+	fit_trees = {PARALLEL_none : fit_tree_f, PARALLEL_features : fit_tree_parallel_features_f,
+				 PARALLEL_nodes : fit_tree_parallel_nodes_f}
+	predict_trees = (predict_frozen_tree_single_f, predict_frozen_tree_single_parallel_f,
+					 predict_frozen_tree_into_f, predict_frozen_tree_blocks_f)
+	return fit_trees, predict_trees
+
+# The fit_tree variant for each format of xb and parallel mode, and the predict variants for 
+#  each format of xb as (single path, single path parallel, all paths, all paths parallel).
+#  These come after exec_op since fill_go_right and the predict functions use it.
+FIT_TREE_VARIANTS = {'dense' : {PARALLEL_none : fit_tree, PARALLEL_features : fit_tree_parallel_features,
+								PARALLEL_nodes : fit_tree_parallel_nodes}}
+PREDICT_VARIANTS = {'dense' : (predict_frozen_tree_single, predict_frozen_tree_single_parallel,
+							   predict_frozen_tree_into, predict_frozen_tree_blocks)}
+
+# For a CSRMatrix binary splits are counted from the nonzeros of the node's rows. The rows 
+#  can't be counted one feature at a time, so with parallel='features' only the continous 
+#  features are searched in parallel.
+FIT_TREE_VARIANTS['csr'], PREDICT_VARIANTS['csr'] = compile_binary_format_variants("csr",
+	counts_per_binary_split_csr, binary_value_csr, row_slice_csr)
+
+# For a BitMatrix binary splits are counted with popcounts, one feature at a time
+counts_per_binary_split_bits_parallel = compile_variant(counts_per_binary_split_bits, "parallel",
+	parallel=True, cache=True)
+FIT_TREE_VARIANTS['bits'], PREDICT_VARIANTS['bits'] = compile_binary_format_variants("bits",
+	counts_per_binary_split_bits, binary_value_bits, row_slice_bits, counts_per_binary_split_bits_parallel)
+
+
 ######### Repr/Visualtization #########
 
 def str_op(op_enum):
@@ -1295,7 +2250,20 @@ tree_classifier_presets = {
 		"secondary_criterion" : 0,
 		"secondary_total_func" : 0,
 		'sep_nan' : True,
-		'cache_nodes' : False
+		'cache_nodes' : False,
+		'fingerprint_nodes' : False,
+		'memo_size' : 0,
+		'max_splits_per_node' : 0,
+		'max_nodes' : 0,
+		'best_first' : False,
+		'max_depth' : None,
+		'min_samples_split' : 2,
+		'min_samples_leaf' : 1,
+		'min_impurity_decrease' : 0.0,
+		'presort' : False,
+		'max_bins' : 0,
+		'parallel' : 'none',
+		'n_jobs' : -1
 	},
 	'decision_tree_weighted_gini' : {
 		'criterion' : 'weighted_gini',
@@ -1306,7 +2274,20 @@ tree_classifier_presets = {
 		"secondary_criterion" : 0,
 		"secondary_total_func" : 0,
 		'sep_nan' : True,
-		'cache_nodes' : False
+		'cache_nodes' : False,
+		'fingerprint_nodes' : False,
+		'memo_size' : 0,
+		'max_splits_per_node' : 0,
+		'max_nodes' : 0,
+		'best_first' : False,
+		'max_depth' : None,
+		'min_samples_split' : 2,
+		'min_samples_leaf' : 1,
+		'min_impurity_decrease' : 0.0,
+		'presort' : False,
+		'max_bins' : 0,
+		'parallel' : 'none',
+		'n_jobs' : -1
 	},
 	'decision_tree_w_greedy_backup' : {
 		'criterion' : 'gini',
@@ -1317,7 +2298,20 @@ tree_classifier_presets = {
 		"secondary_criterion" : 'prop_neg',
 		"secondary_total_func" : 'min',
 		'sep_nan' : True,
-		'cache_nodes' : False
+		'cache_nodes' : False,
+		'fingerprint_nodes' : False,
+		'memo_size' : 0,
+		'max_splits_per_node' : 0,
+		'max_nodes' : 0,
+		'best_first' : False,
+		'max_depth' : None,
+		'min_samples_split' : 2,
+		'min_samples_leaf' : 1,
+		'min_impurity_decrease' : 0.0,
+		'presort' : False,
+		'max_bins' : 0,
+		'parallel' : 'none',
+		'n_jobs' : -1
 	},
 	'ambiguity_tree' : {
 		'criterion' : 'weighted_gini',
@@ -1328,7 +2322,20 @@ tree_classifier_presets = {
 		"secondary_criterion" : 0,
 		"secondary_total_func" : 0,
 		'sep_nan' : True,
-		'cache_nodes' : True
+		'cache_nodes' : True,
+		'fingerprint_nodes' : False,
+		'memo_size' : 0,
+		'max_splits_per_node' : 0,
+		'max_nodes' : 0,
+		'best_first' : False,
+		'max_depth' : None,
+		'min_samples_split' : 2,
+		'min_samples_leaf' : 1,
+		'min_impurity_decrease' : 0.0,
+		'presort' : False,
+		'max_bins' : 0,
+		'parallel' : 'none',
+		'n_jobs' : -1
 	},
 	'greedy_cover_tree' : {
 		'criterion' : 'prop_neg',
@@ -1339,7 +2346,20 @@ tree_classifier_presets = {
 		"secondary_total_func" : 0,
 		'positive_class' : 1,
 		'sep_nan' : True,
-		'cache_nodes' : False
+		'cache_nodes' : False,
+		'fingerprint_nodes' : False,
+		'memo_size' : 0,
+		'max_splits_per_node' : 0,
+		'max_nodes' : 0,
+		'best_first' : False,
+		'max_depth' : None,
+		'min_samples_split' : 2,
+		'min_samples_leaf' : 1,
+		'min_impurity_decrease' : 0.0,
+		'presort' : False,
+		'max_bins' : 0,
+		'parallel' : 'none',
+		'n_jobs' : -1
 	}
 
 
@@ -1361,20 +2381,56 @@ class TreeClassifier(object):
 			secondary_total_func: The name of the secondary total_func, defaults to 'sum'
 			positive_class: The integer id for the positive class (used in prediction)
 			sep_nan: If set to True then use a ternary tree that treats nan's seperately 
+			cache_nodes: If set to True then children with identical samples share a node
+			fingerprint_nodes: If set to True then cache_nodes only keeps a 128-bit fingerprint
+			  of the samples of each node instead of a copy of them, which uses far less memory
+			  on large datasets. Nodes with the same fingerprint and counts are assumed to have 
+			  the same samples.
+			memo_size: If nonzero then the split search of the last memo_size distinct sets 
+			  of samples is kept, so that branches with the same samples (which can happen
+			  with split_choice='all_max') aren't searched again. The hits and misses are 
+			  counted in memo_hits and memo_misses after fitting.
+			max_splits_per_node: If nonzero then at most this many of the tied best splits 
+			  are made on each node (only matters for split_choice='all_max').
+			max_nodes: If nonzero then at most this many nodes are made, once there is no room
+			  left any unsplit nodes become leaves.
+			best_first: If set to True then the node whose best split decreases impurity the
+			  most is split next, instead of splitting the tree one depth at a time. Mostly 
+			  useful with max_nodes.
+			max_depth: If not None then nodes at this depth (the root is at 0) become leaves.
+			min_samples_split: Nodes with fewer samples than this become leaves.
+			min_samples_leaf: Splits must leave at least this many samples on each side.
+			min_impurity_decrease: Splits must decrease impurity (as combined by total_func) 
+			  by more than this.
+			presort: If set to True then argsort each continous feature once before fitting 
+			  instead of at every node.
+			max_bins: If nonzero (at most 255) quantize each continous feature into at most
+			  this many quantile bins before fitting and split on bin edges.
+			parallel: 'none', 'features', or 'nodes'. If 'features' then the candidate splits 
+			  on each feature are evaluated on multiple threads. If 'nodes' then the nodes at 
+			  each depth are evaluated on multiple threads. The tree is the same either way.
+			n_jobs: The number of threads used when parallel isn't 'none', -1 uses all of them.
 		'''
 		kwargs = {**tree_classifier_presets[preset_type], **kwargs}
 
 		criterion, total_func, split_choice, pred_choice, secondary_criterion, \
-		 secondary_total_func, positive_class, sep_nan, cache_nodes = \
+		 secondary_total_func, positive_class, sep_nan, cache_nodes, fingerprint_nodes, \
+		 memo_size, max_splits_per_node, max_nodes, best_first, max_depth, min_samples_split, \
+		 min_samples_leaf, min_impurity_decrease, presort, max_bins, parallel, n_jobs = \
 			itemgetter('criterion', 'total_func', 'split_choice', 'pred_choice', 
 				"secondary_criterion", 'secondary_total_func', 'positive_class',
-				'sep_nan', 'cache_nodes')(kwargs)
+				'sep_nan', 'cache_nodes', 'fingerprint_nodes', 'memo_size', 
+				'max_splits_per_node', 'max_nodes', 'best_first', 'max_depth', 
+				'min_samples_split', 'min_samples_leaf', 'min_impurity_decrease', 'presort', 
+				'max_bins', 'parallel', 'n_jobs')(kwargs)
+		if(max_bins is None): max_bins = 0
 
 		g = globals()
 		criterion_enum = g.get(f"CRITERION_{criterion}",None)
 		total_enum = g.get(f"TOTAL_{total_func}",None)
 		split_enum = g.get(f"SPLIT_CHOICE_{split_choice}",None)
 		pred_choice_enum = g.get(f"PRED_CHOICE_{pred_choice}",None)
+		parallel_enum = g.get(f"PARALLEL_{parallel}",None)
 		criterion_enum2 = g.get(f"CRITERION_{secondary_criterion}",0)
 		total_enum2 = g.get(f"TOTAL_{secondary_total_func}", TOTAL_sum)
 
@@ -1382,24 +2438,53 @@ class TreeClassifier(object):
 		if(total_enum is None): raise ValueError(f"Invalid criterion {total_func}")
 		if(split_enum is None): raise ValueError(f"Invalid split_choice {split_choice}")
 		if(pred_choice_enum is None): raise ValueError(f"Invalid pred_choice {pred_choice}")
+		if(max_bins != 0 and not (2 <= max_bins <= 255)): raise ValueError(f"Invalid max_bins {max_bins}, must be between 2 and 255")
+		if(parallel_enum is None): raise ValueError(f"Invalid parallel {parallel}")
+		if(n_jobs != -1 and n_jobs < 1): raise ValueError(f"Invalid n_jobs {n_jobs}, must be -1 or at least 1")
+		if(memo_size < 0): raise ValueError(f"Invalid memo_size {memo_size}, must be at least 0")
+		if(max_splits_per_node < 0): raise ValueError(f"Invalid max_splits_per_node {max_splits_per_node}, must be at least 0")
+		if(max_nodes < 0): raise ValueError(f"Invalid max_nodes {max_nodes}, must be at least 0")
+		if(max_depth is not None and max_depth < 1): raise ValueError(f"Invalid max_depth {max_depth}, must be None or at least 1")
+		if(min_samples_split < 2): raise ValueError(f"Invalid min_samples_split {min_samples_split}, must be at least 2")
+		if(min_samples_leaf < 1): raise ValueError(f"Invalid min_samples_leaf {min_samples_leaf}, must be at least 1")
+		if(min_impurity_decrease < 0.0): raise ValueError(f"Invalid min_impurity_decrease {min_impurity_decrease}, must be at least 0")
+		if(max_depth is None): max_depth = 0
+		min_impurity_decrease = float(min_impurity_decrease)
 		self.positive_class = positive_class
-
-		@njit(cache=True)
-		def _fit(xb,xc,y,miss_mask,ft_weights):	
-			out =fit_tree(xb,xc,y,miss_mask,
-					ft_weights=ft_weights,
-					# missing_values=missing_values,
-					criterion_enum=literally(criterion_enum),
-					total_enum=literally(total_enum),
-					split_enum=literally(split_enum),
-					positive_class=positive_class,
-					criterion_enum2=literally(criterion_enum2),
-					total_enum2=literally(total_enum2),
-					sep_nan=literally(sep_nan),
-					cache_nodes=literally(cache_nodes)
-				 )
-			return out
-		self._fit = _fit
+		self.parallel_enum = parallel_enum
+		self.n_jobs = n_jobs
+
+		def make_fit(_fit_tree):
+			@njit(cache=True)
+			def _fit(xb,xc,y,miss_mask,ft_weights):	
+				out =_fit_tree(xb,xc,y,miss_mask,
+						ft_weights=ft_weights,
+						# missing_values=missing_values,
+						criterion_enum=literally(criterion_enum),
+						total_enum=literally(total_enum),
+						split_enum=literally(split_enum),
+						positive_class=positive_class,
+						criterion_enum2=literally(criterion_enum2),
+						total_enum2=literally(total_enum2),
+						sep_nan=literally(sep_nan),
+						cache_nodes=literally(cache_nodes),
+						fingerprint_nodes=literally(fingerprint_nodes),
+						memo_size=memo_size,
+						max_splits_per_node=max_splits_per_node,
+						max_nodes=max_nodes,
+						best_first=literally(best_first),
+						max_depth=max_depth,
+						min_samples_split=min_samples_split,
+						min_samples_leaf=min_samples_leaf,
+						min_impurity_decrease=min_impurity_decrease,
+						presort=literally(presort),
+						max_bins=literally(max_bins)
+					 )
+				return out
+			return _fit
+		# A fit for each format of xb (see binary_format) 
+		self._fits = {fmt : make_fit(fit_trees[parallel_enum]) 
+						for fmt, fit_trees in FIT_TREE_VARIANTS.items()}
 
 		@njit(cache=True)
 		def _inf_gain(xb,xc,y,miss_mask,ft_weights):	
@@ -1413,35 +2498,58 @@ class TreeClassifier(object):
 			return out
 		self._inf_gain = _inf_gain
 
-		@njit(cache=True)
-		def _predict(tree, xb, xc, positive_class):	
-			out =predict_tree(tree,xb,xc,
-					pred_choice_enum=literally(pred_choice_enum),
-					positive_class=positive_class,
-					decode_classes=True
-				 )
-			return out
-		self._predict = _predict
+		def make_predict(_predict_tree):
+			@njit(cache=True, nogil=True)
+			def _predict(tree, xb, xc, positive_class, out):	
+				return _predict_tree(tree,xb,xc,out,
+						pred_choice_enum=literally(pred_choice_enum),
+						positive_class=positive_class,
+						decode_classes=True
+					 )
+			return _predict
+		# A serial and a parallel predict for each format of xb. Trees with one split per 
+		#  node can be predicted by walking one path per sample.
+		k = 0 if split_enum == SPLIT_CHOICE_single_max else 2
+		self._predicts = {fmt : (make_predict(predict_trees[k]), make_predict(predict_trees[k+1]))
+							for fmt, predict_trees in PREDICT_VARIANTS.items()}
 		self.tree = None
+		self.frozen_tree = None
+		self.memo_hits, self.memo_misses = 0, 0
 		
 	def fit(self,xb,xc,y,miss_mask=None, ft_weights=None):
+		'''Fits the tree. xb may be a scipy CSR/CSC matrix, in which case only its 
+			nonzeros are visited, or a BitMatrix (see pack_bits). A sparse xc is made dense.'''
 		if(xb is None): xb = np.empty((0,0), dtype=np.uint8)
 		if(xc is None): xc = np.empty((0,0), dtype=np.float64)
+		if(issparse(xc)): xc = xc.toarray()
 		if(miss_mask is None): miss_mask = np.zeros_like(xc, dtype=np.bool)
-		if(ft_weights is None): ft_weights = np.empty(xb.shape[1]+xc.shape[1], dtype=np.float64)
-		xb = xb.astype(np.uint8)
+		if(ft_weights is None): ft_weights = np.ones(xb.shape[1]+xc.shape[1], dtype=np.float64)
+		fmt, xb = binary_format(xb)
+		_fit = self._fits[fmt]
+		# Splits are counted one feature at a time, so keep a column-major copy of xb
+		if(fmt == 'dense'): xb = np.asfortranarray(xb)
 		xc = xc.astype(np.float64)
 		y = y.astype(np.int64)
 		miss_mask = miss_mask.astype(np.bool)
 		ft_weights = ft_weights.astype(np.float64)
 		# assert miss_mask.shape == xc.shape
-		self.tree = self._fit(xb, xc, y, miss_mask, ft_weights)
+		if(self.parallel_enum != PARALLEL_none):
+			n_threads = numba.get_num_threads()
+			numba.set_num_threads(resolve_n_jobs(self.n_jobs))
+			try:
+				self.tree = _fit(xb, xc, y, miss_mask, ft_weights)
+			finally:
+				numba.set_num_threads(n_threads)
+		else:
+			self.tree = _fit(xb, xc, y, miss_mask, ft_weights)
+		self.frozen_tree = freeze_tree(self.tree)
+		self.memo_hits, self.memo_misses = self.tree.memo_hits, self.tree.memo_misses
 
 	def inf_gain(self,xb,xc,y,miss_mask=None, ft_weights=None):
 		if(xb is None): xb = np.empty((0,0), dtype=np.uint8)
 		if(xc is None): xc = np.empty((0,0), dtype=np.float64)
 		if(miss_mask is None): miss_mask = np.zeros_like(xc, dtype=np.bool)
-		if(ft_weights is None): ft_weights = np.empty(xb.shape[1]+xc.shape[1], dtype=np.float64)
+		if(ft_weights is None): ft_weights = np.ones(xb.shape[1]+xc.shape[1], dtype=np.float64)
 		xb = xb.astype(np.uint8)
 		xc = xc.astype(np.float64)
 		y = y.astype(np.int64)
@@ -1451,14 +2559,45 @@ class TreeClassifier(object):
 		return self._inf_gain(xb, xc, y, miss_mask, ft_weights)
 
 
-	def predict(self,xb,xc,positive_class=None):
+	def predict(self,xb,xc,positive_class=None,out=None,n_jobs=1):
+		'''Predicts the class of each row of xb and xc. If 'out' is given the 
+			predictions are written into it (must be an int64 array of length n_rows).
+			If 'n_jobs' isn't 1 the rows are split across that many threads (-1 for all).
+			Like in fit() xb may be a scipy CSR/CSC matrix or a BitMatrix.'''
 		if(self.tree is None): raise RuntimeError("TreeClassifier must be fit before predict() is called.")
 		if(positive_class is None): positive_class = self.positive_class
 		if(xb is None): xb = np.empty((0,0), dtype=np.uint8)
 		if(xc is None): xc = np.empty((0,0), dtype=np.float64)
-		xb = xb.astype(np.uint8)
+		if(issparse(xc)): xc = xc.toarray()
+		fmt, xb = binary_format(xb)
+		_predict, _predict_parallel = self._predicts[fmt]
 		xc = xc.astype(np.float64)
-		return self._predict(self.tree, xb, xc, positive_class)
+		L = max(xb.shape[0],len(xc))
+		if(out is None): out = np.empty((L,), dtype=np.int64)
+		if(out.shape != (L,) or out.dtype != np.int64): 
+			raise ValueError(f"out must be an int64 array of shape ({L},)")
+		if(n_jobs != 1):
+			if(n_jobs < 1 and n_jobs != -1): raise ValueError(f"Invalid n_jobs {n_jobs}, must be -1 or at least 1")
+			n_threads = numba.get_num_threads()
+			numba.set_num_threads(resolve_n_jobs(n_jobs))
+			try:
+				return _predict_parallel(self.frozen_tree, xb, xc, positive_class, out)
+			finally:
+				numba.set_num_threads(n_threads)
+		return _predict(self.frozen_tree, xb, xc, positive_class, out)
+
+	def predict_chunks(self,chunks,positive_class=None,n_jobs=1):
+		'''Yields the predictions for each (xb, xc) block in the iterable 'chunks'. The
+			GIL is released while predicting, so each block is predicted on a background 
+			thread while the next one is pulled from 'chunks'. At most two blocks are 
+			held at a time.'''
+		with ThreadPoolExecutor(max_workers=1) as pool:
+			pending = None
+			for xb, xc in chunks:
+				future = pool.submit(self.predict, xb, xc, positive_class, None, n_jobs)
+				if(pending is not None): yield pending.result()
+				pending = future
+			if(pending is not None): yield pending.result()
 
 	def __str__(self):
 		return str_tree(self.tree)
@@ -491,7 +491,303 @@ def test_nan():
 
 
 
+
+#### test_presort ####
+
+def setup_continuous(N=1000, M=20, seed=0):
+	'''Random continous data (w/ some NaNs) where the label depends on a few features'''
+	rng = np.random.RandomState(seed)
+	data = rng.normal(size=(N,M))
+	labels = ((data[:,0] > 0) ^ (data[:,1] > .5) | (data[:,2] < -1)).astype(np.int64)
+	data[rng.random_sample((N,M)) < .02] = np.nan
+	return data, labels
+
+def test_presort():
+	'''Presorting the continous features should produce the exact same trees'''
+	data, labels = setup_continuous(200, 6)
+	for preset in ['decision_tree', 'ambiguity_tree', 'greedy_cover_tree']:
+		dt = TreeClassifier(preset)
+		dt.fit(None, data, labels)
+		ps_dt = TreeClassifier(preset, presort=True)
+		ps_dt.fit(None, data, labels)
+		assert str(dt) == str(ps_dt)
+		assert (dt.predict(None, data) == ps_dt.predict(None, data)).all()
+
+	data1, labels1 = setup1()
+	data1_flt = data1.astype(np.float64)
+	dt = TreeClassifier('decision_tree', presort=True)
+	dt.fit(data1, data1_flt, labels1)
+	assert np.sum(dt.predict(data1, data1_flt) == labels1) >= 6
+
+
+#### test_max_bins ####
+
+def test_max_bins():
+	'''Histogram binned trees should split about as well as exact ones'''
+	data1, labels1 = setup1()
+	data1_flt = data1.astype(np.float64)
+	for preset in ['decision_tree', 'ambiguity_tree']:
+		dt = TreeClassifier(preset)
+		dt.fit(None, data1_flt, labels1)
+		hdt = TreeClassifier(preset, max_bins=255)
+		hdt.fit(None, data1_flt, labels1)
+		assert (dt.predict(None, data1_flt) == hdt.predict(None, data1_flt)).all()
+
+	# Many more distinct values than bins
+	data, labels = setup_continuous()
+	dt = TreeClassifier('decision_tree_weighted_gini', max_bins=16)
+	dt.fit(None, data, labels)
+	assert np.mean(dt.predict(None, data) == labels) >= .95
+
+	# NaNs get their own bin
+	data1, data2, data3, data4, labels, miss_mask = setup_nan()
+	dt = TreeClassifier('ambiguity_tree', max_bins=8)
+	dt.fit(None, data1, labels) 
+	assert tree_is_pure(dt)
+	assert np.sum(dt.predict(None,data1) == labels) == 6
+
+	with pytest.raises(ValueError):
+		TreeClassifier('decision_tree', max_bins=256)
+
+
+#### test_leaf_counts ####
+
+def test_leaf_counts():
+	'''Every training sample should end up in exactly one leaf of a decision tree'''
+	data, labels = setup_continuous(300, 6)
+	data_bin = (data > 0).astype(np.uint8)
+	miss_mask = np.zeros(data.shape, dtype=np.bool)
+	miss_mask[::7,1] = 1
+	for kwargs in [{}, {'presort' : True}, {'max_bins' : 16}, {'sep_nan' : False}]:
+		dt = TreeClassifier('decision_tree_weighted_gini', **kwargs)
+		dt.fit(data_bin[:,3:], data, labels, miss_mask)
+		leaf_counts = [node.counts for node in dt.tree.nodes if node.ttype == TreeTypes_LEAF]
+		assert np.sum(leaf_counts) == len(labels)
+
 	
+#### test_parallel ####
+
+def test_parallel():
+	'''Evaluating the features or nodes on multiple threads should produce the exact same trees'''
+	data, labels = setup_continuous(200, 6)
+	data_bin = (data > 0).astype(np.uint8)
+	for preset in ['decision_tree', 'ambiguity_tree', 'greedy_cover_tree']:
+		dt = TreeClassifier(preset)
+		dt.fit(data_bin, data, labels)
+		for parallel in ['features', 'nodes']:
+			par_dt = TreeClassifier(preset, parallel=parallel, n_jobs=2)
+			par_dt.fit(data_bin, data, labels)
+			assert str(dt) == str(par_dt)
+			assert (dt.predict(data_bin, data) == par_dt.predict(data_bin, data)).all()
+
+	# Parallel over nodes with presorting and histograms
+	for kwargs in [{'presort' : True}, {'max_bins' : 16}]:
+		dt = TreeClassifier('decision_tree_weighted_gini', **kwargs)
+		dt.fit(None, data, labels)
+		par_dt = TreeClassifier('decision_tree_weighted_gini', parallel='nodes', **kwargs)
+		par_dt.fit(None, data, labels)
+		assert str(dt) == str(par_dt)
+
+	with pytest.raises(ValueError):
+		TreeClassifier('decision_tree', parallel='bogus')
+	with pytest.raises(ValueError):
+		TreeClassifier('decision_tree', n_jobs=0)
+
+
+#### test_frozen_tree ####
+
+def test_frozen_tree():
+	'''Predicting with the frozen tree should give the same result as with the fitted tree'''
+	data, labels = setup_continuous(200, 6)
+	data_bin = (data > 0).astype(np.uint8)
+	for preset in ['decision_tree', 'ambiguity_tree']:
+		for pred_choice in ['majority', 'pure_majority', 'majority_general', 'pure_majority_general']:
+			dt = TreeClassifier(preset, pred_choice=pred_choice)
+			dt.fit(data_bin, data, labels)
+			pred_choice_enum = globals()[f'PRED_CHOICE_{pred_choice}']
+			expected = predict_tree(dt.tree, data_bin, data, pred_choice_enum, 1)
+			assert (dt.predict(data_bin, data) == expected).all()
+			assert len(dt.frozen_tree.ttype) == len(dt.tree.nodes)
+
+	# Predicting into a preallocated buffer
+	dt = TreeClassifier('decision_tree')
+	dt.fit(data_bin, data, labels)
+	out = np.empty(len(labels), dtype=np.int64)
+	assert dt.predict(data_bin, data, out=out) is out
+	assert (out == predict_tree(dt.tree, data_bin, data, PRED_CHOICE_majority, 1)).all()
+	with pytest.raises(ValueError):
+		dt.predict(data_bin, data, out=np.empty(3, dtype=np.int64))
+
+
+#### test_parallel_predict ####
+
+def test_parallel_predict():
+	'''Predicting on multiple threads or in chunks should give the same predictions'''
+	data, labels = setup_continuous(300, 6)
+	data_bin = (data > 0).astype(np.uint8)
+	for preset in ['decision_tree', 'ambiguity_tree']:
+		dt = TreeClassifier(preset)
+		dt.fit(data_bin, data, labels)
+		pred = dt.predict(data_bin, data)
+		assert (dt.predict(data_bin, data, n_jobs=2) == pred).all()
+		assert (dt.predict(None, data, n_jobs=-1) == dt.predict(None, data)).all()
+
+		chunks = ((data_bin[i:i+64], data[i:i+64]) for i in range(0, len(data), 64))
+		chunked_pred = np.concatenate(list(dt.predict_chunks(chunks, n_jobs=2)))
+		assert (chunked_pred == pred).all()
+
+def test_sparse():
+	'''Fitting and predicting on sparse binary features should match the dense ones'''
+	from scipy.sparse import csr_matrix, csc_matrix
+	rng = np.random.RandomState(0)
+	data_bin = (rng.rand(300, 40) < .1).astype(np.uint8)
+	data_bin[rng.rand(300, 40) < .02] = 2 # missing
+	labels = ((data_bin[:,0] == 1) | (data_bin[:,1] == 1) & (data_bin[:,2] != 1)).astype(np.int64)
+	labels[rng.rand(300) < .1] = 2
+	# Missing values are only used with the decision tree, since with cache_nodes a sample
+	#  in an ambiguity tree can end up in no leaves if its split sends every sample left
+	for preset, parallel, data_bin in [('decision_tree', 'none', data_bin), 
+			('ambiguity_tree', 'nodes', np.where(data_bin == 2, 0, data_bin))]:
+		dt = TreeClassifier(preset, parallel=parallel)
+		dt.fit(data_bin, None, labels)
+		st = TreeClassifier(preset, parallel=parallel)
+		st.fit(csc_matrix(data_bin), None, labels)
+		assert str(st) == str(dt)
+
+		pred = dt.predict(data_bin, None)
+		assert (st.predict(csr_matrix(data_bin), None) == pred).all()
+		assert (st.predict(csr_matrix(data_bin), None, n_jobs=2) == pred).all()
+
+def test_bit_packed():
+	'''Fitting and predicting on bit-packed binary features should match the dense ones'''
+	rng = np.random.RandomState(1)
+	data_bin = (rng.rand(200, 70) < .2).astype(np.uint8)
+	data_bin[rng.rand(200, 70) < .02] = 2 # missing
+	labels = ((data_bin[:,3] == 1) ^ (data_bin[:,65] == 1)).astype(np.int64)
+	labels[rng.rand(200) < .1] = 2
+	for preset, parallel, data_bin in [('decision_tree', 'none', data_bin), 
+			('decision_tree', 'features', data_bin),
+			('ambiguity_tree', 'nodes', np.where(data_bin == 2, 0, data_bin))]:
+		dt = TreeClassifier(preset, parallel=parallel)
+		dt.fit(data_bin, None, labels)
+		bt = TreeClassifier(preset, parallel=parallel)
+		bt.fit(pack_bits(data_bin), None, labels)
+		assert str(bt) == str(dt)
+
+		pred = dt.predict(data_bin, None)
+		assert (bt.predict(pack_bits(data_bin), None) == pred).all()
+		assert (bt.predict(pack_bits(data_bin), None, n_jobs=2) == pred).all()
+
+def setup_binary(N=300, M=70, seed=0):
+	'''Random binary data (w/ some missing values) where the label depends on a few features'''
+	rng = np.random.RandomState(seed)
+	data = (rng.rand(N, M) < .1).astype(np.uint8)
+	labels = ((data[:,0] == 1) ^ (data[:,1] == 1) | (data[:,2] == 1)).astype(np.int64)
+	data[rng.rand(N, M) < .02] = 2 # missing
+	return data, labels
+
+def test_fused_binary_counts():
+	'''The fused binary split kernel should match counting and then computing impurities'''
+	data, labels = setup_binary()
+	y = labels.astype(np.uint32)
+	inds = np.random.RandomState(0).permutation(len(y))[:200].astype(np.uint32)
+	for criterion_enum in [CRITERION_gini, CRITERION_prop_neg, CRITERION_weighted_gini]:
+		countsPS = np.zeros((data.shape[1], 2, 2), dtype=np.uint32)
+		impurities = np.zeros((data.shape[1], 2), dtype=np.float64)
+		counts_then_impurities_per_binary_split(data, y, inds, 2, criterion_enum, 1, countsPS, impurities)
+		for xb in [data, np.asfortranarray(data)]:
+			countsPS_f, impurities_f = np.zeros_like(countsPS), np.zeros_like(impurities)
+			counts_impurities_per_binary_split(xb, y, inds, 2, criterion_enum, 1, countsPS_f, impurities_f)
+			assert (countsPS_f == countsPS).all()
+			assert np.allclose(impurities_f, impurities)
+
+def test_fingerprint_nodes():
+	'''Identifying cached nodes by fingerprints should produce the exact same trees'''
+	data, labels = setup_binary(200, 30)
+	data[data == 2] = 0
+	for data, labels in [setup1(), (data, labels)]:
+		at = TreeClassifier('ambiguity_tree')
+		at.fit(data, None, labels)
+		ft = TreeClassifier('ambiguity_tree', fingerprint_nodes=True)
+		ft.fit(data, None, labels)
+		assert str(ft) == str(at)
+		assert (ft.predict(data, None) == at.predict(data, None)).all()
+
+def test_memo_size():
+	'''Memoizing the split search should produce the exact same trees'''
+	data, labels = setup1()
+	at = TreeClassifier('ambiguity_tree', cache_nodes=False)
+	at.fit(data, None, labels)
+	assert at.memo_hits == 0 and at.memo_misses == 0
+	for memo_size in [1, 2, 64]:
+		mt = TreeClassifier('ambiguity_tree', cache_nodes=False, memo_size=memo_size)
+		mt.fit(data, None, labels)
+		assert str(mt) == str(at)
+		assert mt.memo_misses > 0
+	# Without cache_nodes some branches end up with the same samples
+	assert mt.memo_hits > 0
+
+	with pytest.raises(ValueError):
+		TreeClassifier('ambiguity_tree', memo_size=-1)
+
+def test_split_budget():
+	'''Limiting the number of splits and nodes should bound the size of the tree'''
+	data, labels = setup_binary(200, 30)
+	data[data == 2] = 0
+	for preset in ['decision_tree', 'ambiguity_tree']:
+		dt = TreeClassifier(preset)
+		dt.fit(data, None, labels)
+		pred = dt.predict(data, None)
+
+		# Splitting the best node first makes the same splits, just in a different order
+		bt = TreeClassifier(preset, best_first=True)
+		bt.fit(data, None, labels)
+		assert len(bt.tree.nodes) == len(dt.tree.nodes)
+		assert (bt.predict(data, None) == pred).all()
+
+		for best_first in [False, True]:
+			st = TreeClassifier(preset, max_nodes=9, max_splits_per_node=1, best_first=best_first)
+			st.fit(data, None, labels)
+			assert len(st.tree.nodes) <= 9
+			assert all(len(node.split_data) <= 1 for node in st.tree.nodes)
+			assert len(st.predict(data, None)) == len(labels)
+
+	with pytest.raises(ValueError):
+		TreeClassifier('ambiguity_tree', max_nodes=-1)
+
+def tree_depth(tree, node=0):
+	return max([1+tree_depth(tree, s[i]) for s in tree.nodes[node].split_data for i in (2,3)], default=0)
+
+def test_stopping_rules():
+	'''The sklearn-style stopping rules should prune the tree'''
+	data, labels = setup_binary(300, 30)
+	data[data == 2] = 0
+	for preset in ['decision_tree', 'ambiguity_tree']:
+		dt = TreeClassifier(preset)
+		dt.fit(data, None, labels)
+		assert tree_depth(dt.tree) > 2
+
+		st = TreeClassifier(preset, max_depth=2)
+		st.fit(data, None, labels)
+		assert tree_depth(st.tree) <= 2
+
+		st = TreeClassifier(preset, min_samples_split=50, min_samples_leaf=10)
+		st.fit(data, None, labels)
+		assert len(st.tree.nodes) < len(dt.tree.nodes)
+		for node in st.tree.nodes:
+			assert node.counts.sum() >= 10
+			if(len(node.split_data) > 0): assert node.counts.sum() >= 50
+
+		st = TreeClassifier(preset, min_impurity_decrease=1e6)
+		st.fit(data, None, labels)
+		assert len(st.tree.nodes) == 1
+
+	with pytest.raises(ValueError):
+		TreeClassifier('decision_tree', max_depth=0)
+	with pytest.raises(ValueError):
+		TreeClassifier('decision_tree', min_samples_leaf=0)
+
+
 #### test_as_conditions ####
 
 # def test_as_conditions():
@@ -556,6 +852,27 @@ def test_b_cont_ambiguity_tree_fit(benchmark):
 	benchmark.pedantic(f, warmup_rounds=1, iterations=100)
 
 
+@pytest.mark.benchmark(group="fit_tree_presort")
+def test_b_cont_decision_tree_fit_large(benchmark):
+	data, labels = setup_continuous()
+	dt = TreeClassifier('decision_tree')
+
+	def f():
+		return dt.fit(None, data, labels)
+
+	benchmark.pedantic(f, warmup_rounds=1, iterations=10)
+
+@pytest.mark.benchmark(group="fit_tree_presort")
+def test_b_cont_decision_tree_fit_large_presort(benchmark):
+	data, labels = setup_continuous()
+	dt = TreeClassifier('decision_tree', presort=True)
+
+	def f():
+		return dt.fit(None, data, labels)
+
+	benchmark.pedantic(f, warmup_rounds=1, iterations=10)
+
+
 @pytest.mark.benchmark(group="fit_tree")
 def test_b_sklearn_tree_fit(benchmark):
 	data1, labels1 = setup1()
@@ -566,6 +883,31 @@ def test_b_sklearn_tree_fit(benchmark):
 
 	benchmark.pedantic(f, warmup_rounds=1, iterations=100)
 
+@pytest.mark.benchmark(group="binary_split_counts")
+def test_b_binary_split_counts_unfused(benchmark):
+	data, labels = setup_binary(10000, 5000)
+	y, inds = labels.astype(np.uint32), np.arange(len(labels), dtype=np.uint32)
+	countsPS = np.zeros((data.shape[1], 2, 2), dtype=np.uint32)
+	impurities = np.zeros((data.shape[1], 2), dtype=np.float64)
+
+	def f():
+		counts_then_impurities_per_binary_split(data, y, inds, 2, CRITERION_gini, 1, countsPS, impurities)
+
+	benchmark.pedantic(f, warmup_rounds=1, iterations=5)
+
+@pytest.mark.benchmark(group="binary_split_counts")
+def test_b_binary_split_counts_fused(benchmark):
+	data, labels = setup_binary(10000, 5000)
+	data = np.asfortranarray(data)
+	y, inds = labels.astype(np.uint32), np.arange(len(labels), dtype=np.uint32)
+	countsPS = np.zeros((data.shape[1], 2, 2), dtype=np.uint32)
+	impurities = np.zeros((data.shape[1], 2), dtype=np.float64)
+
+	def f():
+		counts_impurities_per_binary_split(data, y, inds, 2, CRITERION_gini, 1, countsPS, impurities)
+
+	benchmark.pedantic(f, warmup_rounds=1, iterations=5)
+
 #### Predict BENCHMARKS ####
 
 @pytest.mark.benchmark(group="predict_tree")